@@ -0,0 +1,197 @@
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import random
+import zipfile
+import argparse
+import tempfile
+
+from typing import Callable
+
+from handler import ZipParser
+from sources import SOURCE_PATHS, MinecraftJarParser, RecipeSourcesMatrix, extract_sources_from_files
+from graph import RecipeGraph, memory_report
+from resolver import resolve_recipe_tree, resolve_multi_tree
+from bulk import BillOfMaterials
+
+def generate_modpack( directory : str, mods : int = 10, recipes : int = 200, tag_depth : int = 2, fanout : int = 2, cycle_density : float = 0.05, raw_items : int = 50, library_jars : int = 0, seed : int = 0 ) -> list[str]:
+	'''
+	Write a synthetic modpack of jars to the directory and return their paths, most important first.
+
+	Every mod adds recipes items, each with fanout alternative recipes built from raw items, items of
+	earlier mods and a chain of nested tags tag_depth deep. cycle_density is the chance an item also
+	gets a recipe turning it back into one of its ingredients (ingot <-> block style loops).
+	library_jars adds jars of class files and assets only, with no data/ content.
+	'''
+	random.seed( seed )
+	os.makedirs( directory, exist_ok=True )
+	raws = [ f'base:raw_{index}' for index in range(raw_items) ]
+	known = list( raws )
+	filepaths = [ ]
+
+	def ingredient( namespace : str ) -> dict:
+		if tag_depth > 0 and random.random() < 0.1:
+			return { 'tag' : f'{namespace}:group_0' }
+		return { 'item' : random.choice( known ) }
+
+	for mod in range( mods ):
+		namespace = f'mod{mod}'
+		filepath = os.path.join( directory, f'{namespace}.jar' )
+		with zipfile.ZipFile( filepath, 'w', zipfile.ZIP_DEFLATED ) as jar:
+			jar.writestr( 'META-INF/MANIFEST.MF', 'Manifest-Version: 1.0\n' )
+			jar.writestr( f'assets/{namespace}/lang/en_us.json', json.dumps( { 'item' : namespace } ) )
+			for depth in range( tag_depth ):
+				values = [ random.choice( raws ) for _ in range(3) ]
+				if depth + 1 < tag_depth:
+					values.append( f'#{namespace}:group_{depth + 1}' )
+				jar.writestr( f'data/{namespace}/tags/items/group_{depth}.json', json.dumps( { 'replace' : False, 'values' : values } ) )
+				jar.writestr( f'data/{namespace}/tags/blocks/group_{depth}.json', json.dumps( { 'values' : values[:1] } ) )
+			# a recipe under a namespace containing "tags" is still a recipe
+			jar.writestr( f'data/{namespace}_nametags/recipes/name_tag.json', json.dumps( { 'type' : 'minecraft:crafting_shapeless', 'ingredients' : [ { 'item' : raws[0] } ], 'result' : f'{namespace}:name_tag' } ) )
+
+			items = [ ]
+			for index in range( recipes ):
+				output = f'{namespace}:item_{index}'
+				for alternative in range( fanout ):
+					kind = random.random()
+					if kind < 0.15:
+						data = { 'type' : 'minecraft:smelting', 'ingredient' : ingredient( namespace ), 'result' : output }
+					elif kind < 0.5:
+						keys = { character : ingredient( namespace ) for character in 'ABC'[:random.randint(1, 3)] }
+						pattern = [ ''.join( random.choice( list(keys.keys()) + [ ' ' ] ) for _ in range(3) ) for _ in range(3) ]
+						pattern[0] = 'A' + pattern[0][1:]
+						data = { 'type' : 'minecraft:crafting_shaped', 'pattern' : pattern, 'key' : keys, 'result' : { 'item' : output, 'count' : random.randint(1, 4) } }
+					else:
+						data = { 'type' : 'minecraft:crafting_shapeless', 'ingredients' : [ ingredient( namespace ) for _ in range( random.randint(1, 6) ) ], 'result' : { 'item' : output, 'count' : random.randint(1, 4) } }
+					suffix = '' if alternative == 0 else f'_alt_{alternative}'
+					jar.writestr( f'data/{namespace}/recipes/item_{index}{suffix}.json', json.dumps( data ) )
+				if len(items) > 0 and random.random() < cycle_density:
+					target = random.choice( items )
+					data = { 'type' : 'minecraft:crafting_shapeless', 'ingredients' : [ { 'item' : output } ], 'result' : { 'item' : target, 'count' : 9 } }
+					jar.writestr( f'data/{namespace}/recipes/{target.split(":")[1]}_from_item_{index}.json', json.dumps( data ) )
+				items.append( output )
+			known.extend( items )
+		filepaths.append( filepath )
+
+	for library in range( library_jars ):
+		filepath = os.path.join( directory, f'library{library}.jar' )
+		with zipfile.ZipFile( filepath, 'w', zipfile.ZIP_DEFLATED ) as jar:
+			jar.writestr( 'META-INF/MANIFEST.MF', 'Manifest-Version: 1.0\n' )
+			for index in range( recipes ):
+				jar.writestr( f'org/library{library}/Class{index}.class', bytes( 64 ) )
+			jar.writestr( f'assets/library{library}/lang/en_us.json', json.dumps( { 'item' : 'library' } ) )
+		filepaths.insert( random.randrange( len(filepaths) + 1 ), filepath )
+	filepaths.reverse()
+	return filepaths
+
+def measure( function : Callable[[], object], repeat : int ) -> float:
+	best = None
+	for _ in range( repeat ):
+		start = time.perf_counter()
+		function()
+		elapsed = time.perf_counter() - start
+		best = elapsed if best == None else min( best, elapsed )
+	return best
+
+def run_benchmarks( filepaths : list[str], repeat : int = 3, queries : int = 50, index_filepath : str | None = None, bulk_queries : int = 3000 ) -> dict[str, float]:
+	results = { }
+	first = filepaths[0]
+
+	def extract_to_disk() -> None:
+		success, data = ZipParser( first ).extract_files_in_paths( SOURCE_PATHS )
+		del data
+	results['zip_extract_disk'] = measure( extract_to_disk, repeat )
+	results['zip_stream_json'] = measure( lambda : sum( 1 for _ in ZipParser( first ).stream_json_in_paths( SOURCE_PATHS ) ), repeat )
+	results['jar_parse'] = measure( lambda : MinecraftJarParser( first ).extract_recipe_sources(), repeat )
+
+	per_jar = [ MinecraftJarParser( filepath ).extract_recipe_sources() for filepath in filepaths ]
+	extracted = MinecraftJarParser( first ).extract_recipe_sources( stream=False )
+	if extracted != None and set( per_jar[0].recipes ) != set( extracted.recipes ):
+		raise RuntimeError(f'Streamed and extracted parses of {first} found different recipes')
+	def merge_tags() -> None:
+		merged = RecipeSourcesMatrix()
+		for sources in reversed( per_jar ):
+			merged.tags.merge( sources.tags )
+		merged.tags.compile()
+	results['tag_merge'] = measure( merge_tags, repeat )
+
+	results['pack_ingest'] = measure( lambda : extract_sources_from_files( filepaths ), 1 )
+	if index_filepath != None:
+		extract_sources_from_files( filepaths, index_filepath=index_filepath )
+		results['pack_ingest_indexed'] = measure( lambda : extract_sources_from_files( filepaths, index_filepath=index_filepath ), repeat )
+
+	sources = extract_sources_from_files( filepaths )
+	results['graph_compile'] = measure( lambda : RecipeGraph.from_sources( sources ), repeat )
+	graph = RecipeGraph.from_sources( sources )
+
+	random.seed( 1 )
+	craftable = [ graph.names[item] for item in range( graph.item_count ) if graph.chosen[item] != -1 ]
+	orders = [ (random.choice( craftable ), random.randint(1, 64)) for _ in range( queries ) ]
+	results['resolve_recipe_tree'] = measure( lambda : [ resolve_recipe_tree( graph, item, amount ) for item, amount in orders ], repeat )
+	results['resolve_multi_tree'] = measure( lambda : resolve_multi_tree( graph, orders ), repeat )
+
+	# the same bulk_queries independent orders through the scalar resolver and the bulk engine
+	bulk = BillOfMaterials( graph )
+	bulk_orders = [ (random.choice( craftable ), random.randint(1, 64)) for _ in range( bulk_queries ) ]
+	results['bulk_scalar_resolve'] = measure( lambda : [ resolve_recipe_tree( graph, item, amount ) for item, amount in bulk_orders ], repeat )
+	results['bulk_query'] = measure( lambda : bulk.query( bulk_orders ), repeat )
+	results['bulk_query_fractional'] = measure( lambda : bulk.query( bulk_orders, fractional=True ), repeat )
+	return results
+
+def compare_baseline( results : dict[str, float], baseline : dict[str, float], tolerance : float ) -> list[str]:
+	'''Names of the benchmarks slower than the baseline by more than the tolerance.'''
+	regressions = [ ]
+	for name, seconds in results.items():
+		previous = baseline.get( name )
+		if previous != None and previous > 0 and seconds > previous * (1.0 + tolerance):
+			regressions.append( name )
+	return regressions
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser( description='Benchmark ingestion and resolution on a synthetic modpack.' )
+	parser.add_argument( '--mods', type=int, default=10 )
+	parser.add_argument( '--recipes', type=int, default=200 )
+	parser.add_argument( '--tag-depth', type=int, default=2 )
+	parser.add_argument( '--fanout', type=int, default=2 )
+	parser.add_argument( '--cycle-density', type=float, default=0.05 )
+	parser.add_argument( '--library-jars', type=int, default=0 )
+	parser.add_argument( '--repeat', type=int, default=3 )
+	parser.add_argument( '--queries', type=int, default=50 )
+	parser.add_argument( '--bulk-queries', type=int, default=3000 )
+	parser.add_argument( '--output', default=None, help='write the results as json' )
+	parser.add_argument( '--baseline', default=None, help='json results to compare against' )
+	parser.add_argument( '--tolerance', type=float, default=0.25 )
+	arguments = parser.parse_args()
+
+	config = {
+		'mods' : arguments.mods, 'recipes' : arguments.recipes, 'tag_depth' : arguments.tag_depth,
+		'fanout' : arguments.fanout, 'cycle_density' : arguments.cycle_density,
+		'library_jars' : arguments.library_jars,
+	}
+	with tempfile.TemporaryDirectory() as directory:
+		filepaths = generate_modpack( directory, **config )
+		index_filepath = os.path.join( directory, 'index.bin' )
+		results = run_benchmarks( filepaths, arguments.repeat, arguments.queries, index_filepath, arguments.bulk_queries )
+		sources = extract_sources_from_files( filepaths )
+		memory = memory_report( sources, RecipeGraph.from_sources( sources ), index_filepath )
+
+	report = { 'config' : config, 'python' : sys.version.split()[0], 'results' : results, 'memory' : memory }
+	print( json.dumps( report, indent=4 ) )
+	if arguments.output != None:
+		with open( arguments.output, 'w' ) as file:
+			file.write( json.dumps( report, indent=4 ) )
+
+	if arguments.baseline != None:
+		with open( arguments.baseline, 'r' ) as file:
+			baseline = json.loads( file.read() )
+		if baseline.get('config') != config:
+			print('Baseline was recorded with a different config, comparing anyway.')
+		regressions = compare_baseline( results, baseline.get('results', { }), arguments.tolerance )
+		if len(regressions) != 0:
+			print('Regressions:', ', '.join( regressions ))
+			sys.exit(1)
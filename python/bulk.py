@@ -0,0 +1,260 @@
+
+from __future__ import annotations
+
+import numpy
+
+from recipe_types import SMELTING
+from graph import RecipeGraph
+from resolver import chosen_recipe, ingredient_span
+
+def csr_gather( offsets : numpy.ndarray, rows : numpy.ndarray ) -> tuple[numpy.ndarray, numpy.ndarray]:
+	'''(position of the row in rows, index into the values) of every value of the given CSR rows.'''
+	starts = offsets[rows]
+	lengths = offsets[rows + 1] - starts
+	ends = numpy.cumsum( lengths )
+	owners = numpy.repeat( numpy.arange( len(rows) ), lengths )
+	return owners, numpy.repeat( starts - ( ends - lengths ), lengths ) + numpy.arange( ends[-1] if len(ends) != 0 else 0 )
+
+def sum_by_key( keys : numpy.ndarray, amounts : numpy.ndarray ) -> tuple[numpy.ndarray, numpy.ndarray]:
+	'''Unique keys in ascending order and the exact int64 sum of the amounts of each.'''
+	order = numpy.argsort( keys, kind='stable' )
+	keys, amounts = keys[order], amounts[order]
+	starts = numpy.flatnonzero( numpy.concatenate( ( [ True ], keys[1:] != keys[:-1] ) ) ) if len(keys) != 0 else numpy.zeros( 0, dtype=numpy.int64 )
+	return keys[starts], numpy.add.reduceat( amounts, starts ) if len(starts) != 0 else amounts[:0]
+
+class BillOfMaterials:
+	'''
+	Bulk bill-of-materials engine over a compiled RecipeGraph.
+
+	Every item is ordered once, parents before ingredients, using its chosen recipe.
+	Chosen recipes never close a cycle, any item still found on a cycle is treated as a raw
+	material (see cyclic), so each craftable item gets a precomputed per-unit raw vector.
+	The chosen recipe edges, the raw vectors and the smelts per unit are kept as numpy arrays,
+	raw vectors compressed sparse row style: raw_ids/raw_amounts[ raw_offsets[i] : raw_offsets[i + 1] ].
+
+	query( ..., fractional=True ) answers N (target, amount) queries by scaling the per-unit rows,
+	query( ..., fractional=False ) pushes the demand of all N queries through the graph as sparse
+	(item, query, amount) entries, one level of the graph at a time, applying the ceil batch
+	rounding exactly like resolve_recipe_tree once an item has received all of its demand.
+	'''
+
+	graph : RecipeGraph
+	order : list[int]
+	cyclic : set[int]
+	recipes : list[int]
+	leaf : numpy.ndarray
+	level : numpy.ndarray
+	position : numpy.ndarray
+	batch : numpy.ndarray
+	smelting : numpy.ndarray
+	edge_offsets : numpy.ndarray
+	edge_child : numpy.ndarray
+	edge_count : numpy.ndarray
+	raw_offsets : numpy.ndarray
+	raw_ids : numpy.ndarray
+	raw_amounts : numpy.ndarray
+	smelt_vector : numpy.ndarray
+
+	def __init__( self, graph : RecipeGraph ):
+		self.graph = graph
+		self.cyclic = set()
+		self.recipes = [ chosen_recipe( graph, item ) for item in range( graph.item_count ) ]
+		self.order = self.compute_order()
+		self.compute_edges()
+		self.compute_levels()
+		self.compute_raw_vectors()
+
+	def is_leaf( self, item : int ) -> bool:
+		return self.recipes[item] == -1 or item in self.cyclic
+
+	def compute_order( self ) -> list[int]:
+		representative, ingredient_ids = self.graph.representative, self.graph.ingredient_ids
+		order = [ ]
+		state = { } # 1 = on the current path, 2 = finished
+		for root in range( self.graph.item_count ):
+			if representative[root] != root or state.get( root ) != None:
+				continue
+			state[root] = 1
+			stack = [ (root, *ingredient_span( self.graph, self.recipes[root] )) ]
+			while len(stack) > 0:
+				item, index, end = stack[-1]
+				if index == end:
+					stack.pop()
+					state[item] = 2
+					order.append( item )
+					continue
+				stack[-1] = (item, index + 1, end)
+				child = representative[ ingredient_ids[index] ]
+				visited = state.get( child )
+				if visited == 1:
+					self.cyclic.add( child )
+				if visited != None:
+					continue
+				state[child] = 1
+				stack.append( (child, *ingredient_span( self.graph, self.recipes[child] )) )
+		order.reverse()
+		return order
+
+	def compute_edges( self ) -> None:
+		'''The ingredients of the chosen recipe of every item as (child, count) edges, none for leaves.'''
+		graph = self.graph
+		smelting_types = [ index for index, name in enumerate(graph.types) if name in SMELTING ]
+		recipes = numpy.asarray( self.recipes, dtype=numpy.int64 )
+		self.leaf = recipes == -1
+		self.leaf[ list( self.cyclic ) ] = True
+		chosen = numpy.where( self.leaf, 0, recipes )
+		ingredient_offsets = numpy.asarray( graph.ingredient_offsets, dtype=numpy.int64 )
+		starts = numpy.where( self.leaf, 0, ingredient_offsets[chosen] )
+		lengths = numpy.where( self.leaf, 0, ingredient_offsets[chosen + 1] - starts )
+		self.edge_offsets = numpy.concatenate( ( [ 0 ], numpy.cumsum( lengths ) ) )
+		indices = numpy.repeat( starts - self.edge_offsets[:-1], lengths ) + numpy.arange( self.edge_offsets[-1] )
+		representative = numpy.asarray( graph.representative, dtype=numpy.int64 )
+		self.edge_child = representative[ numpy.asarray( graph.ingredient_ids, dtype=numpy.int64 )[indices] ]
+		self.edge_count = numpy.asarray( graph.ingredient_counts, dtype=numpy.int64 )[indices]
+		self.batch = numpy.where( self.leaf, 1, numpy.asarray( graph.recipe_count, dtype=numpy.int64 )[chosen] )
+		self.smelting = ~self.leaf & numpy.isin( numpy.asarray( graph.recipe_type, dtype=numpy.int64 )[chosen], smelting_types )
+
+	def compute_levels( self ) -> None:
+		'''
+		level[i] is greater than the level of every craftable item using item i, so an item has
+		received all of its demand once the lower levels are done. Leaves only collect demand.
+		'''
+		level = [ 0 ] * self.graph.item_count
+		offsets, children, leaf = self.edge_offsets.tolist(), self.edge_child.tolist(), self.leaf.tolist()
+		for item in self.order:
+			if leaf[item]: continue
+			below = level[item] + 1
+			for index in range( offsets[item], offsets[item + 1] ):
+				child = children[index]
+				if not leaf[child] and level[child] < below:
+					level[child] = below
+		self.level = numpy.asarray( level, dtype=numpy.int64 )
+		self.position = numpy.zeros( self.graph.item_count, dtype=numpy.int64 )
+		self.position[ self.order ] = numpy.arange( len(self.order) )
+
+	def compute_raw_vectors( self ) -> None:
+		count = self.graph.item_count
+		offsets, children, counts = self.edge_offsets.tolist(), self.edge_child.tolist(), self.edge_count.tolist()
+		batch, smelting = self.batch.tolist(), self.smelting.tolist()
+		vectors = [ None ] * count
+		smelt_vector = [ 0.0 ] * count
+		# ingredients come after their parents in the order, so walk it backwards
+		for item in reversed( self.order ):
+			if self.leaf[item]:
+				vectors[item] = { item : 1.0 }
+				continue
+			per_craft = 1.0 / batch[item]
+			vector = { }
+			smelts = per_craft if smelting[item] else 0.0
+			for index in range( offsets[item], offsets[item + 1] ):
+				child = children[index]
+				scale = per_craft * counts[index]
+				for raw, amount in vectors[child].items():
+					vector[raw] = vector.get( raw, 0.0 ) + scale * amount
+				smelts += scale * smelt_vector[child]
+			vectors[item] = vector
+			smelt_vector[item] = smelts
+
+		lengths = [ len(vector) if vector != None else 0 for vector in vectors ]
+		self.raw_offsets = numpy.concatenate( ( [ 0 ], numpy.cumsum( lengths, dtype=numpy.int64 ) ) )
+		self.raw_ids = numpy.fromiter( ( raw for vector in vectors if vector != None for raw in vector.keys() ), dtype=numpy.int64, count=int( self.raw_offsets[-1] ) )
+		self.raw_amounts = numpy.fromiter( ( amount for vector in vectors if vector != None for amount in vector.values() ), dtype=numpy.float64, count=int( self.raw_offsets[-1] ) )
+		self.smelt_vector = numpy.asarray( smelt_vector, dtype=numpy.float64 )
+
+	def raw_vector( self, item : int ) -> dict[int, float]:
+		start, end = self.raw_offsets[item], self.raw_offsets[item + 1]
+		return dict( zip( self.raw_ids[start:end].tolist(), self.raw_amounts[start:end].tolist() ) )
+
+	def target_ids( self, items : list[tuple[str, int]] ) -> tuple[numpy.ndarray, numpy.ndarray]:
+		targets = numpy.zeros( len(items), dtype=numpy.int64 )
+		amounts = numpy.zeros( len(items), dtype=numpy.int64 )
+		for row, (item_id, amount) in enumerate(items):
+			item = self.graph.id_of( item_id )
+			assert item != -1, f'Could not find the recipe for {item_id} because it does not exist!'
+			targets[row] = self.graph.representative[item]
+			amounts[row] = amount
+		return targets, amounts
+
+	def query( self, items : list[tuple[str, int]], fractional : bool = False ) -> tuple[list[str], numpy.ndarray, numpy.ndarray]:
+		'''
+		Resolve every (target, amount) independently.
+		Returns (raw material names, N x raws matrix of amounts, N vector of smelts).
+		'''
+		targets, amounts = self.target_ids( items )
+		if fractional == True:
+			return self.query_fractional( targets, amounts )
+		return self.sweep( targets, numpy.arange( len(targets) ), amounts, len(targets) )
+
+	def query_fractional( self, targets : numpy.ndarray, amounts : numpy.ndarray ) -> tuple[list[str], numpy.ndarray, numpy.ndarray]:
+		# targets and raw materials both in order of first appearance, like the per target vectors list them
+		unique, first, rows = numpy.unique( targets, return_index=True, return_inverse=True )
+		rank = numpy.empty( len(unique), dtype=numpy.int64 )
+		rank[ numpy.argsort( first, kind='stable' ) ] = numpy.arange( len(unique) )
+		unique, rows = unique[ numpy.argsort( first, kind='stable' ) ], rank[rows]
+		owners, indices = csr_gather( self.raw_offsets, unique )
+		raws, first, columns = numpy.unique( self.raw_ids[indices], return_index=True, return_inverse=True )
+		rank = numpy.empty( len(raws), dtype=numpy.int64 )
+		rank[ numpy.argsort( first, kind='stable' ) ] = numpy.arange( len(raws) )
+		per_unit = numpy.zeros( (len(unique), len(raws)), dtype=numpy.float64 )
+		per_unit[ owners, rank[columns] ] = self.raw_amounts[indices]
+		names = [ self.graph.names[raw] for raw in raws[ numpy.argsort( rank ) ].tolist() ]
+		return names, per_unit[rows] * amounts[:, None], self.smelt_vector[targets] * amounts
+
+	def query_order_lists( self, order_lists : list[list[tuple[str, int]]] ) -> tuple[list[str], numpy.ndarray, numpy.ndarray]:
+		'''
+		Resolve several order lists in one sweep, each list is one column and its demand is
+		aggregated before the ceil rounding exactly like resolve_orders.
+		Returns (raw material names, lists x raws matrix of amounts, lists vector of smelts).
+		'''
+		targets, amounts = self.target_ids( [ item for items in order_lists for item in items ] )
+		columns = numpy.repeat( numpy.arange( len(order_lists) ), [ len(items) for items in order_lists ] )
+		return self.sweep( targets, columns, amounts, len(order_lists) )
+
+	def sweep( self, items : numpy.ndarray, columns : numpy.ndarray, amounts : numpy.ndarray, width : int ) -> tuple[list[str], numpy.ndarray, numpy.ndarray]:
+		'''
+		Push the (item, column, amount) demand through the chosen recipes.
+
+		Demand waits in one bucket per level, a level is summed per (item, column), rounded up to
+		whole crafts and passed on to the ingredients, which are always on a higher level. Demand
+		reaching a leaf is collected as is. Only the (item, column) pairs actually reached are stored.
+		'''
+		smelts = numpy.zeros( width, dtype=numpy.int64 )
+		buckets : dict[int, list[tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]]] = { }
+		raws = [ ]
+
+		def push( items : numpy.ndarray, columns : numpy.ndarray, amounts : numpy.ndarray ) -> None:
+			leaf = self.leaf[items]
+			raws.append( (items[leaf], columns[leaf], amounts[leaf]) )
+			items, columns, amounts = items[~leaf], columns[~leaf], amounts[~leaf]
+			levels = self.level[items]
+			for level in numpy.unique( levels ).tolist():
+				selected = levels == level
+				buckets.setdefault( level, [ ] ).append( (items[selected], columns[selected], amounts[selected]) )
+
+		push( items, columns, amounts )
+		while len(buckets) > 0:
+			pending = buckets.pop( min( buckets.keys() ) )
+			keys, required = sum_by_key(
+				numpy.concatenate( [ items * width + columns for items, columns, _ in pending ] ),
+				numpy.concatenate( [ amounts for _, _, amounts in pending ] )
+			)
+			items, columns = keys // width, keys % width
+			crafts = -( -required // self.batch[items] )
+			smelted = self.smelting[items]
+			numpy.add.at( smelts, columns[smelted], crafts[smelted] )
+			owners, edges = csr_gather( self.edge_offsets, items )
+			push( self.edge_child[edges], columns[owners], crafts[owners] * self.edge_count[edges] )
+
+		keys, totals = sum_by_key(
+			numpy.concatenate( [ items * width + columns for items, columns, _ in raws ] ),
+			numpy.concatenate( [ amounts for _, _, amounts in raws ] )
+		)
+		items, columns = keys // width, keys % width
+		# raw materials in the global order, like the per item sweep listed them
+		present = numpy.unique( items )
+		present = present[ numpy.argsort( self.position[present], kind='stable' ) ]
+		rows = numpy.zeros( self.graph.item_count, dtype=numpy.int64 )
+		rows[present] = numpy.arange( len(present) )
+		result = numpy.zeros( (width, len(present)), dtype=numpy.int64 )
+		result[ columns, rows[items] ] = totals
+		return [ self.graph.names[raw] for raw in present.tolist() ], result, smelts
@@ -0,0 +1,154 @@
+
+from __future__ import annotations
+
+import heapq
+
+from array import array
+
+from recipe_types import SMELTING
+from graph import RecipeGraph
+
+class CostModel:
+	'''
+	Pluggable cost of a recipe tree: every raw item costs its weight (default_weight unless listed)
+	and every craft of a recipe type costs its type weight on top of its ingredients.
+	'''
+
+	weights : dict[str, float]
+	type_weights : dict[str, float]
+	default_weight : float
+
+	def __init__( self, weights : dict[str, float] = None, type_weights : dict[str, float] = None, default_weight : float = 1.0 ):
+		self.weights = weights or { }
+		self.type_weights = type_weights or { }
+		self.default_weight = default_weight
+
+	def item_cost( self, name : str ) -> float:
+		return self.weights.get( name, self.default_weight )
+
+	def recipe_cost( self, type_name : str ) -> float:
+		return self.type_weights.get( type_name, 0.0 )
+
+	@classmethod
+	def raw_count( cls ) -> CostModel:
+		'''Minimise the number of raw items.'''
+		return cls()
+
+	@classmethod
+	def smelt_count( cls ) -> CostModel:
+		'''Minimise the number of smelts, raw items only break ties.'''
+		return cls( type_weights={ name : 1.0 for name in SMELTING }, default_weight=1e-6 )
+
+class CostTable:
+	'''
+	Cheapest recipe of every item under a cost model, computed once by dynamic programming.
+
+	Components of the graph are processed leaves first (Tarjan numbers a component after
+	everything it reaches). Inside a cyclic component the members are settled cheapest first,
+	a recipe only becomes a candidate once its ingredients in the component are settled, so the
+	selection never closes a cycle. cost[i] is the per-unit cost of item i and chosen[i] its recipe.
+	update_weights() recomputes only the components whose costs can change.
+	'''
+
+	graph : RecipeGraph
+	model : CostModel
+	cost : array
+	chosen : array
+	members : dict[int, list[int]]
+	parents : list[set[int]]
+
+	def __init__( self, graph : RecipeGraph, model : CostModel | None = None ):
+		self.graph = graph
+		self.model = model or CostModel.raw_count()
+		self.cost = array('d', [ 0.0 ]) * graph.item_count
+		self.chosen = array('i', [ -1 ]) * graph.item_count
+		self.members = { }
+		self.parents = [ set() for _ in range( graph.item_count ) ]
+		for item in range( graph.item_count ):
+			if self.members.get( graph.component[item] ) == None:
+				self.members[ graph.component[item] ] = [ item ]
+			else:
+				self.members[ graph.component[item] ].append( item )
+			for child in graph.children_of( item ):
+				self.parents[child].add( item )
+		for component in sorted( self.members.keys() ):
+			self.compute_component( component )
+
+	def recipe_cost( self, recipe : int ) -> float:
+		graph = self.graph
+		total = self.model.recipe_cost( graph.types[ graph.recipe_type[recipe] ] )
+		for index in range( graph.ingredient_offsets[recipe], graph.ingredient_offsets[recipe + 1] ):
+			total += graph.ingredient_counts[index] * self.cost[ graph.representative[ graph.ingredient_ids[index] ] ]
+		return total / graph.recipe_count[recipe]
+
+	def is_ready( self, recipe : int, settled : set[int], component : int ) -> bool:
+		graph = self.graph
+		for index in range( graph.ingredient_offsets[recipe], graph.ingredient_offsets[recipe + 1] ):
+			child = graph.representative[ graph.ingredient_ids[index] ]
+			if graph.component[child] == component and child not in settled:
+				return False
+		return True
+
+	def compute_component( self, component : int ) -> bool:
+		'''(Re)compute the costs of one component, returns True if any cost or choice changed.'''
+		graph = self.graph
+		members = self.members[component]
+		previous = [ (self.cost[item], self.chosen[item]) for item in members ]
+
+		settled = set()
+		heap = [ ]
+		def push_candidates( item : int ) -> None:
+			for recipe in graph.recipes_of( item ):
+				if self.is_ready( recipe, settled, component ):
+					heapq.heappush( heap, (self.recipe_cost( recipe ), recipe, item) )
+
+		for item in members:
+			self.chosen[item] = -1
+			self.cost[item] = self.model.item_cost( graph.names[item] )
+			push_candidates( item )
+
+		while len(heap) > 0:
+			cost, recipe, item = heapq.heappop( heap )
+			if item in settled: continue
+			settled.add( item )
+			self.cost[item] = cost
+			self.chosen[item] = recipe
+			# members using the settled item may now have a ready recipe
+			for parent in self.parents[item]:
+				if graph.component[parent] == component and parent not in settled:
+					push_candidates( parent )
+
+		return previous != [ (self.cost[item], self.chosen[item]) for item in members ]
+
+	def update_weights( self, weights : dict[str, float] = None, type_weights : dict[str, float] = None ) -> None:
+		'''Change the cost model and recompute only the affected components, leaves first.'''
+		graph = self.graph
+		dirty = set()
+		for name in ( weights or { } ).keys():
+			item = graph.id_of( name )
+			if item != -1: dirty.add( graph.component[item] )
+		if type_weights != None:
+			changed_types = set( index for index, name in enumerate(graph.types) if name in type_weights )
+			for recipe in range( graph.recipe_total ):
+				if graph.recipe_output[recipe] != -1 and graph.recipe_type[recipe] in changed_types:
+					dirty.add( graph.component[ graph.recipe_output[recipe] ] )
+		self.model.weights.update( weights or { } )
+		self.model.type_weights.update( type_weights or { } )
+
+		heap = list( dirty )
+		heapq.heapify( heap )
+		visited = set()
+		while len(heap) > 0:
+			component = heapq.heappop( heap )
+			if component in visited: continue
+			visited.add( component )
+			if self.compute_component( component ) == False:
+				continue
+			for item in self.members[component]:
+				for parent in self.parents[item]:
+					if graph.component[parent] != component:
+						heapq.heappush( heap, graph.component[parent] )
+
+	def apply( self ) -> None:
+		'''Make the resolver use the cheapest recipes.'''
+		self.graph.chosen = array('i', self.chosen)
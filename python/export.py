@@ -0,0 +1,94 @@
+
+from __future__ import annotations
+
+import json
+
+from typing import Any, Iterable, Iterator, TextIO
+
+from tags import TagIndex
+from recipe_types import Recipe
+
+def write_json_object( pairs : Iterable[tuple[str, Any]], file : TextIO, indent : int | None = 4, level : int = 0 ) -> int:
+	'''
+	Stream a json object one member at a time, the output matches json.dumps( dict(pairs), indent=indent ).
+	Values that are iterators of pairs are streamed the same way as nested objects.
+	Returns the number of members written.
+	'''
+	total = 0
+	if indent == None:
+		separator, opening, closing = ', ', '{', '}'
+	else:
+		padding = ' ' * ( indent * ( level + 1 ) )
+		separator, opening, closing = ',\n' + padding, '{\n' + padding, '\n' + ' ' * ( indent * level ) + '}'
+	for key, value in pairs:
+		file.write( opening if total == 0 else separator )
+		file.write( json.dumps( key ) + ': ' )
+		if isinstance( value, Iterator ):
+			write_json_object( value, file, indent, level + 1 )
+		else:
+			encoded = json.dumps( value, indent=indent )
+			if indent != None:
+				encoded = encoded.replace( '\n', '\n' + padding )
+			file.write( encoded )
+		total += 1
+	file.write( closing if total != 0 else '{}' )
+	return total
+
+def write_recipes_json( recipes : dict[str, list[Recipe]], file : TextIO, indent : int | None = 4 ) -> int:
+	return write_json_object( ( (item, [ recipe.to_json() for recipe in item_recipes ]) for item, item_recipes in recipes.items() ), file, indent )
+
+def registry_tags( tags : TagIndex, registry : str ) -> Iterator[tuple[str, list[str]]]:
+	for (tag_registry, name), values in tags.tags.items():
+		if tag_registry == registry:
+			yield name, list( values )
+
+def write_tags_json( tags : TagIndex, file : TextIO, indent : int | None = 4 ) -> int:
+	'''Same output as json.dumps( tags.to_json() ), streamed one tag at a time with one pass over the tags per registry.'''
+	registries = dict.fromkeys( registry for registry, _ in tags.tags.keys() )
+	return write_json_object( ( (registry, registry_tags( tags, registry )) for registry in registries ), file, indent )
+
+def write_recipes_ndjson( recipes : dict[str, list[Recipe]], file : TextIO ) -> int:
+	'''One compact line per recipe: { "item" : ..., "recipe" : [ type, station, { ingredient : count }, amount ] }.'''
+	total = 0
+	for item, item_recipes in recipes.items():
+		for recipe in item_recipes:
+			file.write( json.dumps( { 'item' : item, 'recipe' : recipe.to_json() }, separators=(',', ':') ) )
+			file.write( '\n' )
+			total += 1
+	return total
+
+def write_tags_ndjson( tags : TagIndex, file : TextIO ) -> int:
+	'''One compact line per tag: { "registry" : ..., "tag" : ..., "values" : [ ... ], "replace" : ... }.'''
+	total = 0
+	for (registry, name), values in tags.tags.items():
+		record = { 'registry' : registry, 'tag' : name, 'values' : list( values ), 'replace' : (registry, name) in tags.replaced }
+		file.write( json.dumps( record, separators=(',', ':') ) )
+		file.write( '\n' )
+		total += 1
+	return total
+
+def iter_ndjson( filepath : str ) -> Iterator[dict]:
+	'''Lazily read an ndjson export, only one line is decoded at a time.'''
+	with open( filepath, 'r', encoding='utf-8' ) as file:
+		for line in file:
+			if line.strip() == '': continue
+			yield json.loads( line )
+
+def iter_recipes_ndjson( filepath : str ) -> Iterator[tuple[str, Recipe]]:
+	for record in iter_ndjson( filepath ):
+		yield record['item'], Recipe.from_json( record['recipe'] )
+
+def read_recipes_ndjson( filepath : str ) -> dict[str, list[Recipe]]:
+	recipes = { }
+	for item, recipe in iter_recipes_ndjson( filepath ):
+		if recipes.get( item ) == None:
+			recipes[item] = [ recipe ]
+		else:
+			recipes[item].append( recipe )
+	return recipes
+
+def read_tags_ndjson( filepath : str ) -> TagIndex:
+	tags = TagIndex()
+	for record in iter_ndjson( filepath ):
+		tags.add( record['registry'], record['tag'], record['values'], record.get('replace') == True )
+	return tags
@@ -0,0 +1,522 @@
+
+from __future__ import annotations
+
+import os
+import sys
+import numpy
+
+from array import array
+from typing import Iterable, Iterator
+
+from sources import RecipeSourcesMatrix
+from recipe_types import Recipe, recipe_size
+
+def int_array( values : numpy.ndarray ) -> array:
+	return array( 'i', numpy.asarray( values, dtype=numpy.int32 ).tobytes() )
+
+def memory_report( sources : RecipeSourcesMatrix, graph : RecipeGraph | None = None, index_filepath : str | None = None ) -> dict:
+	'''Bytes held by the parsed recipes (total and per recipe), the compiled graph and the on-disk index.'''
+	seen = set()
+	recipes = 0
+	recipe_bytes = sys.getsizeof( sources.recipes )
+	for name, item_recipes in sources.recipes.items():
+		recipe_bytes += sys.getsizeof( name ) + sys.getsizeof( item_recipes )
+		for recipe in item_recipes:
+			recipe_bytes += recipe_size( recipe, seen )
+			recipes += 1
+	report = {
+		'recipes' : recipes,
+		'recipe_bytes' : recipe_bytes,
+		'bytes_per_recipe' : recipe_bytes / recipes if recipes != 0 else 0,
+	}
+	total = recipe_bytes
+	if graph != None:
+		report['graph_bytes'] = graph.memory_size()
+		report['graph_bytes_per_recipe'] = report['graph_bytes'] / graph.recipe_total if graph.recipe_total != 0 else 0
+		total += report['graph_bytes']
+	if index_filepath != None and os.path.exists( index_filepath ):
+		report['index_file_bytes'] = os.path.getsize( index_filepath )
+	report['total_bytes'] = total
+	return report
+
+class RecipeGraph:
+	'''
+	Compiled, interned form of a RecipeSourcesMatrix.
+
+	Item and tag names ("#" prefixed) are interned to integer ids and recipes are flattened
+	into parallel arrays, compressed sparse row style:
+		recipe r produces recipe_count[r] of recipe_output[r] with type types[recipe_type[r]] (-1 for a row dropped by patch()),
+		recipe_names[r] is its resource id (namespace:path of its jar entry, None when unknown),
+		its ingredients are ingredient_ids/ingredient_counts[ ingredient_offsets[r] : ingredient_offsets[r + 1] ],
+		the recipes producing item i are recipe_ids[ recipe_offsets[i] : recipe_offsets[i + 1] ] in source order,
+		representative[i] is the item a tag resolves to (the item itself for plain items),
+		the recipes consuming item or tag i directly are usage_ids[ usage_offsets[i] : usage_offsets[i + 1] ],
+		the tags containing item i (nested tags followed) are member_tags[ member_offsets[i] : member_offsets[i + 1] ].
+
+	At load time the strongly connected components of the item graph (every alternative recipe)
+	are computed: component[i] is the component of item i, numbered after every component it reaches,
+	cyclic_recipe[r] is set when an ingredient of recipe r is in the same component as its output,
+	and chosen[i] is the recipe used for item i: its first non-cyclic recipe when it has one,
+	otherwise its first cyclic recipe whose ingredients inside the component all have a chosen
+	recipe already, repeated until no more items can be grounded this way (-1 when none is left,
+	the item is then treated as raw).
+	'''
+
+	names : list[str]
+	ids : dict[str, int]
+	types : list[str]
+	recipe_names : list[str | None]
+
+	recipe_output : array
+	recipe_count : array
+	recipe_type : array
+	ingredient_offsets : array
+	ingredient_ids : array
+	ingredient_counts : array
+
+	recipe_offsets : array
+	recipe_ids : array
+	representative : array
+
+	usage_offsets : array
+	usage_ids : array
+	member_offsets : array
+	member_tags : array
+
+	component : array
+	component_count : int
+	cyclic_recipe : bytearray
+	chosen : array
+	dead_recipes : int
+
+	downstream_cache : dict[int, tuple[int, ...]]
+
+	def __init__( self ):
+		self.names = [ ]
+		self.ids = { }
+		self.types = [ ]
+		self.recipe_names = [ ]
+		self.recipe_output = array('i')
+		self.recipe_count = array('i')
+		self.recipe_type = array('i')
+		self.ingredient_offsets = array('i', [ 0 ])
+		self.ingredient_ids = array('i')
+		self.ingredient_counts = array('i')
+		self.recipe_offsets = array('i', [ 0 ])
+		self.recipe_ids = array('i')
+		self.representative = array('i')
+		self.usage_offsets = array('i', [ 0 ])
+		self.usage_ids = array('i')
+		self.member_offsets = array('i', [ 0 ])
+		self.member_tags = array('i')
+		self.component = array('i')
+		self.component_count = 0
+		self.cyclic_recipe = bytearray()
+		self.chosen = array('i')
+		self.dead_recipes = 0
+		self.downstream_cache = { }
+
+	def intern( self, name : str ) -> int:
+		index = self.ids.get( name )
+		if index == None:
+			index = len(self.names)
+			self.ids[name] = index
+			self.names.append( name )
+		return index
+
+	def id_of( self, name : str ) -> int:
+		return self.ids.get( name, -1 )
+
+	@property
+	def item_count( self ) -> int:
+		return len(self.names)
+
+	@property
+	def recipe_total( self ) -> int:
+		return len(self.recipe_output)
+
+	def recipes_of( self, item : int ) -> array:
+		return self.recipe_ids[ self.recipe_offsets[item] : self.recipe_offsets[item + 1] ]
+
+	def ingredients_of( self, recipe : int ) -> Iterator[tuple[int, int]]:
+		start, end = self.ingredient_offsets[recipe], self.ingredient_offsets[recipe + 1]
+		return zip( self.ingredient_ids[start:end], self.ingredient_counts[start:end] )
+
+	def has_recipe( self, item : int ) -> bool:
+		return self.recipe_offsets[item] != self.recipe_offsets[item + 1]
+
+	def used_in( self, item : int ) -> list[int]:
+		'''Recipes consuming the item, directly or through a tag that contains it, in recipe order.'''
+		recipes = set( self.usage_ids[ self.usage_offsets[item] : self.usage_offsets[item + 1] ] )
+		for index in range( self.member_offsets[item], self.member_offsets[item + 1] ):
+			tag = self.member_tags[index]
+			recipes.update( self.usage_ids[ self.usage_offsets[tag] : self.usage_offsets[tag + 1] ] )
+		return sorted( recipes )
+
+	def downstream( self, item : int ) -> tuple[int, ...]:
+		'''
+		Every item that can be made from the item through any chain of recipes, in discovery order.
+		Closures are cached per item, the graph never changes once compiled.
+		'''
+		cached = self.downstream_cache.get( item )
+		if cached != None:
+			return cached
+		visited = { item }
+		frontier = [ item ]
+		found = [ ]
+		while len(frontier) > 0:
+			following = [ ]
+			for current in frontier:
+				cached = self.downstream_cache.get( current ) if current != item else None
+				if cached != None:
+					for output in cached:
+						if output in visited: continue
+						visited.add( output )
+						found.append( output )
+					continue
+				for recipe in self.used_in( current ):
+					output = self.recipe_output[recipe]
+					if output in visited: continue
+					visited.add( output )
+					found.append( output )
+					following.append( output )
+			frontier = following
+		self.downstream_cache[item] = tuple( found )
+		return self.downstream_cache[item]
+
+	def children_of( self, item : int ) -> list[int]:
+		'''Every item used by any recipe of the item, tags replaced by their representative.'''
+		children = [ ]
+		for recipe in self.recipes_of( item ):
+			for index in range( self.ingredient_offsets[recipe], self.ingredient_offsets[recipe + 1] ):
+				children.append( self.representative[ self.ingredient_ids[index] ] )
+		return children
+
+	def compute_components( self ) -> None:
+		'''Tarjan's strongly connected components of every item, then mark cyclic recipes and choose a recipe per item.'''
+		self.component = array('i', [ -1 ]) * self.item_count
+		self.component_count = 0
+		self.strong_components( range( self.item_count ) )
+		self.cyclic_recipe = bytearray( self.recipe_total )
+		self.mark_cyclic( range( self.recipe_total ) )
+		self.chosen = array('i', [ -1 ]) * self.item_count
+		self.choose_recipes( range( self.item_count ) )
+
+	def strong_components( self, items : Iterable[int], inside : set[int] | None = None ) -> None:
+		'''
+		Tarjan's algorithm (iterative) over the items, numbering their components from component_count on.
+		With inside only the edges between those items are followed, the caller guarantees no component crosses it.
+		'''
+		count = self.item_count
+		component = self.component
+		lowlink = [ 0 ] * count
+		order = [ -1 ] * count
+		on_stack = bytearray( count )
+		stack = [ ]
+		counter = 0
+		components = self.component_count
+
+		def children_of( item : int ) -> list[int]:
+			children = self.children_of( item )
+			return children if inside == None else [ child for child in children if child in inside ]
+
+		for root in items:
+			if order[root] != -1:
+				continue
+			work = [ (root, children_of( root ), 0) ]
+			order[root] = lowlink[root] = counter
+			counter += 1
+			stack.append( root )
+			on_stack[root] = 1
+			while len(work) > 0:
+				item, children, index = work[-1]
+				if index < len(children):
+					work[-1] = (item, children, index + 1)
+					child = children[index]
+					if order[child] == -1:
+						order[child] = lowlink[child] = counter
+						counter += 1
+						stack.append( child )
+						on_stack[child] = 1
+						work.append( (child, children_of( child ), 0) )
+					elif on_stack[child] == 1:
+						lowlink[item] = min( lowlink[item], order[child] )
+					continue
+				work.pop()
+				if len(work) > 0:
+					parent = work[-1][0]
+					lowlink[parent] = min( lowlink[parent], lowlink[item] )
+				if lowlink[item] == order[item]:
+					while True:
+						member = stack.pop()
+						on_stack[member] = 0
+						component[member] = components
+						if member == item: break
+					components += 1
+		self.component_count = components
+
+	def mark_cyclic( self, recipes : Iterable[int] ) -> None:
+		for recipe in recipes:
+			self.cyclic_recipe[recipe] = 0
+			output = self.component[ self.recipe_output[recipe] ]
+			for index in range( self.ingredient_offsets[recipe], self.ingredient_offsets[recipe + 1] ):
+				if self.component[ self.representative[ self.ingredient_ids[index] ] ] == output:
+					self.cyclic_recipe[recipe] = 1
+					break
+
+	def choose_recipes( self, items : Iterable[int] ) -> None:
+		# prefer a recipe that leaves the component, then ground the rest of the component
+		# through recipes whose ingredients in the component are already grounded
+		pending = [ ]
+		for item in items:
+			self.chosen[item] = -1
+			for recipe in self.recipes_of( item ):
+				if self.cyclic_recipe[recipe] == 0:
+					self.chosen[item] = recipe
+					break
+			else:
+				if self.has_recipe( item ): pending.append( item )
+
+		# in rounds, an item is only grounded through items grounded in earlier rounds so the
+		# choice does not depend on the order items were interned in
+		while len(pending) > 0:
+			grounded = [ ]
+			remaining = [ ]
+			for item in pending:
+				for recipe in self.recipes_of( item ):
+					if self.is_grounded( recipe ):
+						grounded.append( (item, recipe) )
+						break
+				else:
+					remaining.append( item )
+			if len(grounded) == 0: break
+			for item, recipe in grounded:
+				self.chosen[item] = recipe
+			pending = remaining
+
+	def order_components( self ) -> None:
+		'''Renumber the components densely so every component comes after the components it reaches, as Tarjan numbers them.'''
+		component = numpy.frombuffer( self.component, dtype=numpy.int32 )
+		outputs = numpy.frombuffer( self.recipe_output, dtype=numpy.int32 )
+		offsets = numpy.frombuffer( self.ingredient_offsets, dtype=numpy.int32 )
+		owners = outputs[ numpy.repeat( numpy.arange( self.recipe_total ), numpy.diff( offsets ) ) ]
+		children = numpy.frombuffer( self.representative, dtype=numpy.int32 )[ numpy.frombuffer( self.ingredient_ids, dtype=numpy.int32 ) ]
+		live = owners >= 0
+		parents, children = component[ owners[live] ], component[ children[live] ]
+		crossing = parents != children
+		parents, children = parents[crossing], children[crossing]
+
+		total = self.component_count
+		present = numpy.bincount( component, minlength=total ) != 0
+		remaining = numpy.bincount( parents, minlength=total )
+		by_child = numpy.argsort( children, kind='stable' )
+		parent_offsets = numpy.concatenate( ( [ 0 ], numpy.cumsum( numpy.bincount( children, minlength=total ) ) ) )
+		parents = parents[by_child]
+
+		numbering = numpy.full( total, -1, dtype=numpy.int32 )
+		frontier = numpy.flatnonzero( present & ( remaining == 0 ) )
+		assigned = 0
+		while len(frontier) > 0:
+			numbering[frontier] = numpy.arange( assigned, assigned + len(frontier), dtype=numpy.int32 )
+			assigned += len(frontier)
+			starts, ends = parent_offsets[frontier], parent_offsets[frontier + 1]
+			lengths = ends - starts
+			reached = parents[ numpy.repeat( starts - numpy.cumsum( lengths ) + lengths, lengths ) + numpy.arange( lengths.sum() ) ]
+			remaining -= numpy.bincount( reached, minlength=total )
+			reached = numpy.unique( reached )
+			frontier = reached[ remaining[reached] == 0 ]
+		self.component = int_array( numbering[component] )
+		self.component_count = assigned
+
+	def is_grounded( self, recipe : int ) -> bool:
+		output = self.component[ self.recipe_output[recipe] ]
+		for index in range( self.ingredient_offsets[recipe], self.ingredient_offsets[recipe + 1] ):
+			child = self.representative[ self.ingredient_ids[index] ]
+			if self.component[child] == output and self.chosen[child] == -1:
+				return False
+		return True
+
+	def memory_size( self ) -> int:
+		'''Approximate bytes held by the compiled graph.'''
+		total = sys.getsizeof( self.names ) + sys.getsizeof( self.ids ) + sys.getsizeof( self.recipe_names )
+		total += sum( sys.getsizeof( name ) for name in self.names )
+		for values in (
+			self.recipe_output, self.recipe_count, self.recipe_type,
+			self.ingredient_offsets, self.ingredient_ids, self.ingredient_counts,
+			self.recipe_offsets, self.recipe_ids, self.representative,
+			self.usage_offsets, self.usage_ids, self.member_offsets, self.member_tags,
+			self.component, self.cyclic_recipe, self.chosen
+		):
+			total += sys.getsizeof( values )
+		return total
+
+	def add_recipes( self, name : str, recipes : list[Recipe], type_ids : dict[str, int] ) -> int:
+		'''Append the recipes of an item as new rows, returns the id of the item.'''
+		output = self.intern( name )
+		for data in recipes:
+			if type_ids.get( data.type ) == None:
+				type_ids[data.type] = len(self.types)
+				self.types.append( data.type )
+			self.recipe_names.append( data.id )
+			self.recipe_output.append( output )
+			self.recipe_count.append( data.amount or 1 )
+			self.recipe_type.append( type_ids[data.type] )
+			for ingredient in data.ingredients:
+				self.ingredient_ids.append( self.intern( ingredient.name ) )
+				self.ingredient_counts.append( ingredient.count )
+			self.ingredient_offsets.append( len(self.ingredient_ids) )
+		return output
+
+	def link_tags( self, sources : RecipeSourcesMatrix ) -> None:
+		'''Representatives and member lists of every interned tag.'''
+		# item tags resolve to their first concrete member, every member is interned so usage queries reach it
+		chosen : dict[int, int] = { }
+		containing : dict[int, list[int]] = { }
+		for index in range( len(self.names) ):
+			name = self.names[index]
+			if not name.startswith('#'): continue
+			members = [ self.intern( member ) for member in sources.tags.expand( name[1:] ) ]
+			if len(members) != 0:
+				chosen[index] = members[0]
+			for member in members:
+				if containing.get( member ) == None:
+					containing[member] = [ index ]
+				else:
+					containing[member].append( index )
+
+		self.representative = array('i', range( len(self.names) ))
+		for index, member in chosen.items():
+			self.representative[index] = member
+		self.member_offsets = array('i', [ 0 ])
+		self.member_tags = array('i')
+		for index in range( len(self.names) ):
+			self.member_tags.extend( containing.get( index ) or [ ] )
+			self.member_offsets.append( len(self.member_tags) )
+
+	def index_recipes( self ) -> None:
+		'''The producing and consuming recipes of every item, dead rows (recipe_output -1) are left out.'''
+		count = self.item_count
+		outputs = numpy.frombuffer( self.recipe_output, dtype=numpy.int32 )
+		live = numpy.flatnonzero( outputs >= 0 )
+		self.recipe_ids = int_array( live[ numpy.argsort( outputs[live], kind='stable' ) ] )
+		self.recipe_offsets = int_array( numpy.concatenate( ( [ 0 ], numpy.cumsum( numpy.bincount( outputs[live], minlength=count ) ) ) ) )
+
+		offsets = numpy.frombuffer( self.ingredient_offsets, dtype=numpy.int32 )
+		owners = numpy.repeat( numpy.arange( self.recipe_total ), numpy.diff( offsets ) )
+		ingredients = numpy.frombuffer( self.ingredient_ids, dtype=numpy.int32 )
+		used = outputs[owners] >= 0
+		owners, ingredients = owners[used], ingredients[used]
+		self.usage_ids = int_array( owners[ numpy.argsort( ingredients, kind='stable' ) ] )
+		self.usage_offsets = int_array( numpy.concatenate( ( [ 0 ], numpy.cumsum( numpy.bincount( ingredients, minlength=count ) ) ) ) )
+
+	@classmethod
+	def from_sources( cls, sources : RecipeSourcesMatrix ) -> RecipeGraph:
+		graph = cls()
+		type_ids : dict[str, int] = { }
+		for resultant_name, recipes in sources.recipes.items():
+			if type(resultant_name) != str: continue
+			graph.add_recipes( resultant_name, recipes, type_ids )
+		graph.link_tags( sources )
+		graph.index_recipes()
+		graph.compute_components()
+		return graph
+
+	def patch( self, sources : RecipeSourcesMatrix, outputs : Iterable[str] ) -> RecipeGraph:
+		'''
+		The graph of sources that only differ from the sources of this graph in the recipes of the given outputs
+		and in their tags, without recompiling the rest. This graph is left untouched.
+
+		The old rows of those outputs are marked dead and their recipes appended, names are never dropped,
+		so recipe and item ids of everything else stay the same. Components are only recomputed for the items
+		whose component can change: the old components of the changed items and the items that are both reached
+		from and reaching a changed item. Once a quarter of the rows are dead the graph is compiled from scratch.
+		'''
+		graph = RecipeGraph()
+		graph.names = list( self.names )
+		graph.ids = dict( self.ids )
+		graph.types = list( self.types )
+		graph.recipe_names = list( self.recipe_names )
+		for field in ( 'recipe_output', 'recipe_count', 'recipe_type', 'ingredient_offsets', 'ingredient_ids', 'ingredient_counts' ):
+			setattr( graph, field, array( 'i', getattr( self, field ) ) )
+		graph.dead_recipes = self.dead_recipes
+		type_ids = { name : index for index, name in enumerate( graph.types ) }
+
+		changed = set()
+		for name in outputs:
+			if type(name) != str: continue
+			item = graph.id_of( name )
+			if item != -1 and item < self.item_count:
+				for recipe in self.recipes_of( item ):
+					graph.recipe_output[recipe] = -1
+					graph.dead_recipes += 1
+				changed.add( item )
+			recipes = sources.recipes.get( name )
+			if recipes != None:
+				changed.add( graph.add_recipes( name, recipes, type_ids ) )
+		if graph.dead_recipes * 4 > graph.recipe_total:
+			return RecipeGraph.from_sources( sources )
+
+		graph.link_tags( sources )
+		graph.index_recipes()
+		count, previous = graph.item_count, self.item_count
+		# items using a tag that now resolves to another item have new children
+		moved = numpy.flatnonzero( numpy.frombuffer( graph.representative, dtype=numpy.int32 )[:previous] != numpy.frombuffer( self.representative, dtype=numpy.int32 ) )
+		for tag in moved.tolist():
+			for recipe in graph.usage_ids[ graph.usage_offsets[tag] : graph.usage_offsets[tag + 1] ]:
+				changed.add( graph.recipe_output[recipe] )
+		changed.update( range( previous, count ) )
+
+		graph.component = self.component + array('i', [ -1 ]) * ( count - previous )
+		graph.component_count = self.component_count
+		graph.cyclic_recipe = self.cyclic_recipe + bytearray( graph.recipe_total - self.recipe_total )
+		graph.chosen = self.chosen + array('i', [ -1 ]) * ( count - previous )
+
+		affected = graph.reaching( changed, graph.reached( changed ) )
+		old_components = set( self.component[item] for item in changed if item < previous )
+		if len(old_components) != 0:
+			members = numpy.isin( numpy.frombuffer( self.component, dtype=numpy.int32 ), numpy.array( list( old_components ), dtype=numpy.int32 ) )
+			affected.update( numpy.flatnonzero( members ).tolist() )
+		items = sorted( affected )
+		graph.strong_components( items, affected )
+		graph.mark_cyclic( recipe for item in items for recipe in graph.recipes_of( item ) )
+		graph.choose_recipes( items )
+		graph.order_components()
+		return graph
+
+	def reached( self, items : Iterable[int] ) -> set[int]:
+		'''The items and everything their recipes use, directly or not.'''
+		visited = set( items )
+		frontier = list( visited )
+		while len(frontier) > 0:
+			following = [ ]
+			for item in frontier:
+				for child in self.children_of( item ):
+					if child in visited: continue
+					visited.add( child )
+					following.append( child )
+			frontier = following
+		return visited
+
+	def reaching( self, items : Iterable[int], within : set[int] ) -> set[int]:
+		'''The items and every item of within whose recipes use them, directly or not.'''
+		# the tags each item represents, recipes using those tags use the item
+		represented : dict[int, list[int]] = { }
+		for tag in numpy.flatnonzero( numpy.frombuffer( self.representative, dtype=numpy.int32 ) != numpy.arange( self.item_count, dtype=numpy.int32 ) ).tolist():
+			member = self.representative[tag]
+			if represented.get( member ) == None:
+				represented[member] = [ tag ]
+			else:
+				represented[member].append( tag )
+		visited = set( items )
+		frontier = list( visited )
+		while len(frontier) > 0:
+			following = [ ]
+			for item in frontier:
+				for used in [ item ] + ( represented.get( item ) or [ ] ):
+					for recipe in self.usage_ids[ self.usage_offsets[used] : self.usage_offsets[used + 1] ]:
+						parent = self.recipe_output[recipe]
+						if parent in visited or parent not in within: continue
+						visited.add( parent )
+						following.append( parent )
+			frontier = following
+		return visited
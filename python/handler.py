@@ -3,14 +3,109 @@ from __future__ import annotations
 
 import traceback
 import zipfile
+import json
 import os
 import tempfile
 import time
 import re
+import struct
+import logging
 
-from typing import Callable
+from typing import Any, Callable, Iterator
 from shutil import rmtree
 
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+END_OF_CENTRAL_DIRECTORY = struct.Struct('<4s4H2LH')
+
+def required_literal( pattern : str ) -> str:
+	'''Longest literal run outside any group that every match of the pattern contains, '' when none is safe to rely on.'''
+	if any( character in pattern for character in '|[{\\' ):
+		return ''
+	best, run, depth = '', '', 0
+	for character in pattern:
+		if character in '.^$*+?()':
+			# a quantifier makes the character before it optional
+			if character in '*?' and depth == 0: run = run[:-1]
+			if depth == 0 and len(run) > len(best): best = run
+			run = ''
+			if character == '(': depth += 1
+			elif character == ')': depth -= 1
+		elif depth == 0:
+			run += character
+	return run if len(run) > len(best) else best
+
+class PathMatcher:
+	'''
+	Path patterns compiled into a single regex, searched anywhere in the entry name like re.findall.
+
+	Every pattern also contributes the literal its matches must contain ('data/', '/recipes', ...),
+	a plain substring test rejects most entries before the regex runs and lets a whole jar be
+	skipped when its raw central directory contains none of them.
+	'''
+
+	regex : re.Pattern
+	literals : tuple[str, ...] | None
+	suffix : str | None
+
+	def __init__( self, paths : list[str], suffix : str | None = None ):
+		self.regex = re.compile( '|'.join( f'(?:{path})' for path in paths ) )
+		literals = tuple( required_literal( path ) for path in paths )
+		self.literals = None if '' in literals else literals
+		self.suffix = suffix
+
+	def matches( self, filename : str ) -> bool:
+		if self.suffix != None and not filename.endswith( self.suffix ):
+			return False
+		if self.literals != None and not any( literal in filename for literal in self.literals ):
+			return False
+		return self.regex.search( filename ) != None
+
+	def __call__( self, item : zipfile.ZipInfo ) -> bool:
+		return self.matches( item.filename )
+
+	def may_match( self, directory : bytes ) -> bool:
+		'''Whether any entry named in a raw central directory could match.'''
+		if self.suffix != None and self.suffix.encode('utf-8') not in directory:
+			return False
+		if self.literals == None:
+			return True
+		return any( literal.encode('utf-8') in directory for literal in self.literals )
+
+MATCHERS : dict[tuple, PathMatcher] = { }
+
+def path_matcher( paths : list[str], suffix : str | None = None ) -> PathMatcher:
+	key = (tuple(paths), suffix)
+	if MATCHERS.get( key ) == None:
+		MATCHERS[key] = PathMatcher( paths, suffix )
+	return MATCHERS[key]
+
+def json_in_paths( paths : list[str] ) -> PathMatcher:
+	return path_matcher( paths, '.json' )
+
+def read_central_directory( filepath : str ) -> bytes | None:
+	'''Raw central directory of a zip without parsing it, None when it can not be located cheaply (zip64, bad end record).'''
+	with open( filepath, 'rb' ) as file:
+		file.seek( 0, os.SEEK_END )
+		size = file.tell()
+		tail_size = min( size, END_OF_CENTRAL_DIRECTORY.size + 65535 )
+		file.seek( size - tail_size )
+		tail = file.read()
+		end = tail.rfind( b'PK\x05\x06' )
+		if end == -1 or len(tail) - end < END_OF_CENTRAL_DIRECTORY.size:
+			return None
+		_, _, _, _, _, directory_size, directory_offset, _ = END_OF_CENTRAL_DIRECTORY.unpack_from( tail, end )
+		if directory_size == 0xFFFFFFFF or directory_offset == 0xFFFFFFFF:
+			return None
+		# measured back from the end record so data prepended to the jar does not matter
+		start = size - tail_size + end - directory_size
+		if start < 0:
+			return None
+		file.seek( start )
+		return file.read( directory_size )
+
 class ZipExtracts:
 
 	directory : str
@@ -42,7 +137,9 @@ class ZipParser:
 		if not self.file_exists():
 			return False, 'No such file exists at filepath.'
 		try:
-			self.zipreader = zipfile.ZipFile(self.filepath, 'r')
+			with METRICS.timer('jar_open'):
+				self.zipreader = zipfile.ZipFile(self.filepath, 'r')
+			METRICS.increment('jars_opened')
 			return True, 'Opened a new reader.'
 		except Exception as exception:
 			return False, traceback.format_exception( exception )
@@ -61,7 +158,7 @@ class ZipParser:
 		# temporary_directory = tempfile.gettempdir()
 
 		directory = os.path.join( desktop_directory, 'zip_parser_' + str( time.time_ns() ) )
-		print(f'Extracting files from {self.filepath} file to {directory}.')
+		logger.info('Extracting files from %s file to %s.', self.filepath, directory)
 		os.makedirs(directory, exist_ok=True)
 		previous_directory = os.getcwd()
 		os.chdir( directory )
@@ -80,8 +177,7 @@ class ZipParser:
 				self.zipreader.extract(item)
 				# print('Extracted:', item.filename)
 			except Exception as exception:
-				print('Failed to extract:', item.filename)
-				print(exception)
+				logger.error('Failed to extract: %s\n%s', item.filename, exception)
 				break
 
 		os.chdir( previous_directory )
@@ -89,15 +185,99 @@ class ZipParser:
 
 		return True, ZipExtracts( directory, filepaths )
 
+	def stream_files_filter( self, filter : Callable[[zipfile.ZipInfo], bool] ) -> Iterator[tuple[str, bytes]]:
+		'''Yield (path, raw bytes) for each matching entry straight from the open zip, nothing touches the disk.'''
+		success, err = self.open_reader()
+		if success == False:
+			raise IOError(f'Could not open file for reading: {err}')
+		try:
+			with METRICS.timer('entry_filter'):
+				matched = [ item for item in self.zipreader.infolist() if not item.is_dir() and filter(item) == True ]
+			METRICS.increment('entries_matched', len(matched))
+			METRICS.increment('entries_skipped', len(self.zipreader.infolist()) - len(matched))
+			for item in matched:
+				try:
+					yield item.filename, self.read_entry( item )
+				except Exception as exception:
+					logger.error('Failed to read: %s\n%s', item.filename, exception)
+		finally:
+			self.close_reader( )
+
+	def diff_entries_filter( self, filter : Callable[[zipfile.ZipInfo], bool], previous : dict[str, tuple[int, int]] ) -> tuple[list[zipfile.ZipInfo], list[zipfile.ZipInfo], list[str]]:
+		'''
+		Compare the matching entries of the central directory against a previous {filename : (crc, size)} map.
+		Returns (entries in zip order, changed or added entries, removed filenames), nothing is decompressed.
+		'''
+		success, err = self.open_reader()
+		if success == False:
+			raise IOError(f'Could not open file for reading: {err}')
+		entries : list[zipfile.ZipInfo] = [ ]
+		changed : list[zipfile.ZipInfo] = [ ]
+		with METRICS.timer('entry_filter'):
+			for item in self.zipreader.infolist():
+				if item.is_dir() or filter(item) == False:
+					continue
+				entries.append( item )
+				if previous.get( item.filename ) != (item.CRC, item.file_size):
+					changed.append( item )
+		METRICS.increment('entries_matched', len(entries))
+		METRICS.increment('entries_skipped', len(self.zipreader.infolist()) - len(entries))
+		current = set( item.filename for item in entries )
+		removed = [ filename for filename in previous.keys() if filename not in current ]
+		return entries, changed, removed
+
+	def read_entry( self, item : zipfile.ZipInfo ) -> bytes:
+		with METRICS.timer('decompress'):
+			raw = self.zipreader.read(item)
+		METRICS.increment('bytes_read', item.file_size)
+		METRICS.increment('bytes_compressed', item.compress_size)
+		return raw
+
+	def decode_json( self, raw : bytes ) -> Any:
+		with METRICS.timer('json_decode'):
+			return json.loads( raw.decode('utf-8-sig') )
+
+	def read_json( self, item : zipfile.ZipInfo ) -> Any:
+		return self.decode_json( self.read_entry( item ) )
+
+	def stream_json_filter( self, filter : Callable[[zipfile.ZipInfo], bool] ) -> Iterator[tuple[str, Any]]:
+		'''Yield (path, parsed json) for each matching entry, decoded in memory.'''
+		for filename, raw in self.stream_files_filter( filter ):
+			try:
+				yield filename, self.decode_json( raw )
+			except Exception as exception:
+				logger.error('Failed to decode: %s\n%s', filename, exception)
+
 	def extract_files_of_extension( self, extension : str ) -> tuple[bool, ZipExtracts | str]:
 		return self.extract_files_filter(
 			lambda item : item.filename.endswith(extension)
 		)
 
 	def extract_files_in_paths( self, paths : list[str] ) -> tuple[bool, ZipExtracts | str]:
-		def in_path( item : zipfile.ZipInfo ) -> bool:
-			for path in paths:
-				if len(re.findall( path, item.filename )) != 0:
-					return True
-			return False
-		return self.extract_files_filter( in_path )
+		return self.extract_files_filter( path_matcher( paths ) )
+
+	def may_match( self, matcher : PathMatcher ) -> bool:
+		'''Check the raw central directory before the zip is opened, False only when no entry can match.'''
+		if self.zipreader != None or not self.file_exists():
+			return True
+		try:
+			with METRICS.timer('jar_prefilter'):
+				directory = read_central_directory( self.filepath )
+				relevant = directory == None or matcher.may_match( directory )
+		except OSError:
+			return True
+		if relevant == False:
+			METRICS.increment('jars_skipped')
+		return relevant
+
+	def stream_json_in_paths( self, paths : list[str] ) -> Iterator[tuple[str, Any]]:
+		matcher = json_in_paths( paths )
+		if not self.may_match( matcher ):
+			return iter( [ ] )
+		return self.stream_json_filter( matcher )
+
+	def diff_json_in_paths( self, paths : list[str], previous : dict[str, tuple[int, int]] ) -> tuple[list[zipfile.ZipInfo], list[zipfile.ZipInfo], list[str]]:
+		matcher = json_in_paths( paths )
+		if not self.may_match( matcher ):
+			return [ ], [ ], list( previous.keys() )
+		return self.diff_entries_filter( matcher, previous )
@@ -0,0 +1,135 @@
+
+from __future__ import annotations
+
+import os
+import struct
+import marshal
+import hashlib
+import traceback
+
+from typing import Any
+
+INDEX_MAGIC = b'MCRI'
+INDEX_VERSION = 8
+
+# magic, index version, marshal version
+INDEX_HEADER = struct.Struct('<4sHH')
+
+def hash_file( filepath : str, chunk_size : int = 1 << 20 ) -> str:
+	digest = hashlib.sha1()
+	with open( filepath, 'rb' ) as file:
+		while True:
+			chunk = file.read( chunk_size )
+			if not chunk: break
+			digest.update( chunk )
+	return digest.hexdigest()
+
+def file_signature( filepath : str ) -> tuple[int, int]:
+	stat = os.stat( filepath )
+	return stat.st_size, stat.st_mtime_ns
+
+class RecipeIndex:
+	'''
+	Compiled on-disk cache of each jar: its per-entry records, { filename : (crc, size, kind, payload) },
+	optionally a packed form of the whole jar that is cheaper to load than replaying the records,
+	and the entries producing each output, { output : [ filename, ... ] }, for exact lazy lookups.
+
+	Entries are keyed by the absolute jar path and validated by size and mtime,
+	the content hash is only computed when those differ (e.g. a touched but unchanged jar).
+	The file is a small binary header followed by a marshal payload so it loads in one read,
+	the records, packed form and outputs of every jar are nested marshal blobs only decoded when asked for.
+	'''
+
+	filepath : str
+	jars : dict[str, dict]
+	dirty : bool
+
+	def __init__( self, filepath : str ):
+		self.filepath = filepath
+		self.jars = { }
+		self.dirty = False
+
+	def load( self ) -> tuple[bool, str]:
+		if not os.path.exists( self.filepath ):
+			return False, 'No index exists at filepath.'
+		try:
+			with open( self.filepath, 'rb' ) as file:
+				raw = file.read()
+			magic, version, marshal_version = INDEX_HEADER.unpack_from( raw, 0 )
+			if magic != INDEX_MAGIC:
+				return False, 'File is not a recipe index.'
+			if version != INDEX_VERSION or marshal_version != marshal.version:
+				return False, f'Index version {version}/{marshal_version} is outdated.'
+			self.jars = marshal.loads( raw[INDEX_HEADER.size:] )
+			self.dirty = False
+			return True, 'Loaded the index.'
+		except Exception as exception:
+			self.jars = { }
+			return False, ''.join( traceback.format_exception( exception ) )
+
+	def save( self ) -> tuple[bool, str]:
+		directory = os.path.dirname( self.filepath )
+		if directory != '': os.makedirs( directory, exist_ok=True )
+		temporary = self.filepath + '.tmp'
+		try:
+			with open( temporary, 'wb' ) as file:
+				file.write( INDEX_HEADER.pack( INDEX_MAGIC, INDEX_VERSION, marshal.version ) )
+				file.write( marshal.dumps( self.jars ) )
+			os.replace( temporary, self.filepath )
+			self.dirty = False
+			return True, 'Saved the index.'
+		except Exception as exception:
+			return False, ''.join( traceback.format_exception( exception ) )
+
+	def current( self, filepath : str ) -> dict | None:
+		'''The entry of the jar if it has not changed since it was stored.'''
+		entry = self.jars.get( os.path.abspath( filepath ) )
+		if entry == None:
+			return None
+		size, mtime = file_signature( filepath )
+		if entry['size'] == size and entry['mtime'] == mtime:
+			return entry
+		if entry['size'] != size or entry['hash'] != hash_file( filepath ):
+			return None
+		# same contents, only the timestamp moved
+		entry['mtime'] = mtime
+		self.dirty = True
+		return entry
+
+	def get_packed( self, filepath : str ) -> Any | None:
+		'''Return the cached packed form of the jar if it has not changed since it was stored.'''
+		entry = self.current( filepath )
+		if entry == None or entry['packed'] == None:
+			return None
+		return marshal.loads( entry['packed'] )
+
+	def get_outputs( self, filepath : str ) -> dict[str, list[str]] | None:
+		'''Return the entries producing each output of the jar if it has not changed since they were stored.'''
+		entry = self.current( filepath )
+		if entry == None or entry['outputs'] == None:
+			return None
+		return marshal.loads( entry['outputs'] )
+
+	def get_previous( self, filepath : str ) -> Any | None:
+		'''Return the last stored records of the jar even if it has changed since, used for incremental re-indexing.'''
+		entry = self.jars.get( os.path.abspath( filepath ) )
+		return marshal.loads( entry['data'] ) if entry != None else None
+
+	def set( self, filepath : str, data : Any, packed : Any = None, outputs : dict[str, list[str]] | None = None ) -> None:
+		size, mtime = file_signature( filepath )
+		self.jars[ os.path.abspath( filepath ) ] = {
+			'size' : size, 'mtime' : mtime,
+			'hash' : hash_file( filepath ),
+			'data' : marshal.dumps( data ),
+			'packed' : marshal.dumps( packed ) if packed != None else None,
+			'outputs' : marshal.dumps( outputs ) if outputs != None else None
+		}
+		self.dirty = True
+
+	def retain( self, filepaths : list[str] ) -> None:
+		'''Drop the entries of jars that are no longer part of the pack.'''
+		keep = set( os.path.abspath( filepath ) for filepath in filepaths )
+		for key in list( self.jars.keys() ):
+			if key not in keep:
+				self.jars.pop( key )
+				self.dirty = True
@@ -0,0 +1,166 @@
+
+from __future__ import annotations
+
+import logging
+import zipfile
+
+from handler import json_in_paths
+from index import RecipeIndex
+from sources import SOURCE_PATHS, MinecraftJarParser, RecipeSourcesMatrix, entry_kind
+from graph import RecipeGraph
+from tags import tag_key_of
+
+logger = logging.getLogger(__name__)
+
+class LazyRecipeSources:
+	'''
+	Recipes and tags read on demand from the central directory of each jar.
+
+	Opening a jar only reads its central directory, recipe entries are indexed by file name
+	and tag entries by (registry, namespace:path). The JSON of an entry is decompressed the
+	first time the resolver touches an item, the highest priority jar producing it wins.
+	The entries producing an item are looked up in the output map the RecipeIndex keeps for
+	every jar indexed by an earlier ingest. A jar with no current map in the index is parsed
+	in full the first time it is asked for an item, so lookups never guess from file names.
+	Items no jar produces are collected in missing, they are raw in the eager merge as well.
+	'''
+
+	filepaths : list[str]
+	parsers : list[MinecraftJarParser]
+	recipe_entries : list[dict[str, zipfile.ZipInfo]]
+	entry_outputs : list[dict[str, list[str]] | None]
+	tag_entries : list[dict[tuple[str, str], zipfile.ZipInfo]]
+	outputs : list[dict[str, list]]
+	parsed : list[set[str]]
+	matrix : RecipeSourcesMatrix
+	loaded_items : set[str]
+	loaded_tags : set[tuple[str, str]]
+	missing : set[str]
+
+	def __init__( self, filepaths : list[str], index_filepath : str | None = None ):
+		self.filepaths = [ ]
+		self.parsers = [ ]
+		self.recipe_entries = [ ]
+		self.entry_outputs = [ ]
+		self.tag_entries = [ ]
+		self.outputs = [ ]
+		self.parsed = [ ]
+		self.matrix = RecipeSourcesMatrix()
+		self.loaded_items = set()
+		self.loaded_tags = set()
+		self.missing = set()
+		index = None
+		if index_filepath != None:
+			index = RecipeIndex( index_filepath )
+			success, err = index.load()
+			if success == False:
+				logger.info('No recipe index to look outputs up in, jars are parsed in full when used: %s', err)
+				index = None
+		for filepath in filepaths:
+			parser = MinecraftJarParser( filepath )
+			if not parser.may_match( json_in_paths( SOURCE_PATHS ) ):
+				continue
+			success, err = parser.open_reader()
+			if success == False:
+				logger.warning('Could not open file for reading, skipping: %s %s', filepath, err)
+				continue
+			recipe_entries = { }
+			tag_entries = { }
+			for item in parser.zipreader.infolist():
+				kind = entry_kind( item.filename )
+				if kind == 'recipe':
+					recipe_entries[item.filename] = item
+				elif kind == 'tag':
+					tag_entries[ tag_key_of( item.filename ) ] = item
+			self.filepaths.append( filepath )
+			self.parsers.append( parser )
+			self.recipe_entries.append( recipe_entries )
+			self.entry_outputs.append( index.get_outputs( filepath ) if index != None else None )
+			self.tag_entries.append( tag_entries )
+			self.outputs.append( { } )
+			self.parsed.append( set() )
+
+	def close( self ) -> None:
+		for parser in self.parsers:
+			parser.close_reader()
+
+	def candidates( self, jar : int, name : str ) -> list[zipfile.ZipInfo]:
+		'''Recipe entries of the jar that may produce the item, in zip order: exactly those when the jar has an output map, otherwise all of them.'''
+		entries = self.recipe_entries[jar]
+		if self.entry_outputs[jar] == None:
+			return list( entries.values() )
+		return [ entries[filename] for filename in self.entry_outputs[jar].get( name, [ ] ) if filename in entries ]
+
+	def parse_candidates( self, jar : int, name : str ) -> None:
+		parser = self.parsers[jar]
+		outputs = self.outputs[jar]
+		for item in self.candidates( jar, name ):
+			if item.filename in self.parsed[jar]:
+				continue
+			self.parsed[jar].add( item.filename )
+			try:
+				kind, payload = parser.parse_entry( item.filename, parser.read_json( item ) )
+			except Exception as exception:
+				logger.error('Failed to decode: %s\n%s', item.filename, exception)
+				continue
+			if kind != 'recipe':
+				continue
+			for output, recipes in payload.items():
+				if outputs.get( output ) == None:
+					outputs[output] = list( recipes )
+				else:
+					outputs[output].extend( recipes )
+
+	def load_item( self, name : str ) -> list | None:
+		'''Recipes of the item from the highest priority jar that produces it.'''
+		if name not in self.loaded_items:
+			self.loaded_items.add( name )
+			for jar in range( len(self.parsers) ):
+				self.parse_candidates( jar, name )
+				if self.outputs[jar].get( name ) != None:
+					self.matrix.recipes[name] = self.outputs[jar][name]
+					break
+			else:
+				self.missing.add( name )
+				logger.debug('No jar has a recipe for %s, it is raw.', name)
+		return self.matrix.recipes.get( name )
+
+	def load_tag( self, name : str, registry : str = 'items' ) -> tuple[str, ...]:
+		'''Load the tag and its nested tags from every jar, lowest priority first, and return its expansion.'''
+		frontier = [ name ]
+		while len(frontier) > 0:
+			tag = frontier.pop()
+			key = (registry, tag)
+			if key in self.loaded_tags: continue
+			self.loaded_tags.add( key )
+			for jar in reversed( range( len(self.parsers) ) ):
+				item = self.tag_entries[jar].get( key )
+				if item == None: continue
+				try:
+					jsdata = self.parsers[jar].read_json( item )
+				except Exception as exception:
+					logger.error('Failed to decode: %s\n%s', item.filename, exception)
+					continue
+				self.matrix.tags.add( registry, tag, jsdata.get('values'), jsdata.get('replace') == True )
+			for value in self.matrix.tags.get( tag, registry ) or [ ]:
+				if value.startswith('#'): frontier.append( value[1:] )
+		return self.matrix.tags.expand( name, registry )
+
+	def load_sources( self, targets : list[str] ) -> RecipeSourcesMatrix:
+		'''Load everything reachable from the targets through their recipes and return the partial matrix.'''
+		frontier = list( targets )
+		visited = set()
+		while len(frontier) > 0:
+			name = frontier.pop()
+			if name in visited: continue
+			visited.add( name )
+			if name.startswith('#'):
+				members = self.load_tag( name[1:] )
+				if len(members) != 0: frontier.append( members[0] )
+				continue
+			for data in self.load_item( name ) or [ ]:
+				frontier.extend( data.counts().keys() )
+		return self.matrix
+
+	def graph( self, targets : list[str] ) -> RecipeGraph:
+		return RecipeGraph.from_sources( self.load_sources( targets ) )
@@ -0,0 +1,161 @@
+
+from __future__ import annotations
+
+import json
+import time
+import logging
+
+from contextlib import contextmanager
+from typing import Iterator
+
+MetricKey = tuple[str, tuple[tuple[str, str], ...]]
+
+def metric_key( name : str, labels : dict[str, str] | None = None ) -> MetricKey:
+	return name, tuple( sorted( (labels or { }).items() ) )
+
+def format_key( key : MetricKey ) -> str:
+	name, labels = key
+	if len(labels) == 0:
+		return name
+	return name + '{' + ','.join( f'{label}="{value}"' for label, value in labels ) + '}'
+
+class Metrics:
+	'''
+	Per-stage timers and counters of the ingest and resolve pipeline.
+
+	Stages: jar_prefilter, jar_open, entry_filter, decompress, json_decode, recipe_normalise, recipe_merge, tag_merge, resolve.
+	Counters: bytes_read, bytes_compressed, entries_matched, entries_skipped, recipes{type}, recipes_unsupported{type}, ...
+	state() and delta() are picklable so worker processes can send theirs back to be merge()d.
+	'''
+
+	counters : dict[MetricKey, float]
+	timers : dict[str, list[float]]
+	sinks : list
+
+	def __init__( self ):
+		self.counters = { }
+		self.timers = { }
+		self.sinks = [ ]
+
+	def reset( self ) -> None:
+		self.counters.clear()
+		self.timers.clear()
+
+	def increment( self, name : str, amount : float = 1, labels : dict[str, str] | None = None ) -> None:
+		key = metric_key( name, labels )
+		self.counters[key] = self.counters.get( key, 0 ) + amount
+
+	def record( self, stage : str, seconds : float, count : int = 1 ) -> None:
+		timer = self.timers.get( stage )
+		if timer == None:
+			self.timers[stage] = [ seconds, count ]
+		else:
+			timer[0] += seconds
+			timer[1] += count
+
+	@contextmanager
+	def timer( self, stage : str ) -> Iterator[None]:
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.record( stage, time.perf_counter() - start )
+
+	def snapshot( self ) -> dict:
+		'''Readable view for the sinks, counters keyed by name{label="value"}.'''
+		return {
+			'counters' : { format_key( key ) : value for key, value in self.counters.items() },
+			'timers' : { stage : { 'seconds' : value[0], 'count' : value[1] } for stage, value in self.timers.items() },
+		}
+
+	def state( self ) -> dict:
+		'''Picklable copy of the raw counters and timers.'''
+		return { 'counters' : dict( self.counters ), 'timers' : { stage : list(value) for stage, value in self.timers.items() } }
+
+	def delta( self, before : dict ) -> dict:
+		'''State of what changed since an earlier state().'''
+		counters = { }
+		for key, value in self.counters.items():
+			value -= before['counters'].get( key, 0 )
+			if value != 0: counters[key] = value
+		timers = { }
+		for stage, value in self.timers.items():
+			previous = before['timers'].get( stage, [ 0.0, 0 ] )
+			if value[1] != previous[1]:
+				timers[stage] = [ value[0] - previous[0], value[1] - previous[1] ]
+		return { 'counters' : counters, 'timers' : timers }
+
+	def merge( self, state : dict ) -> None:
+		for key, value in state['counters'].items():
+			self.counters[key] = self.counters.get( key, 0 ) + value
+		for stage, value in state['timers'].items():
+			self.record( stage, value[0], value[1] )
+
+	def add_sink( self, sink ) -> None:
+		self.sinks.append( sink )
+
+	def flush( self ) -> None:
+		snapshot = self.snapshot()
+		for sink in self.sinks:
+			sink.write( snapshot )
+
+class LoggingSink:
+
+	logger : logging.Logger
+	level : int
+
+	def __init__( self, logger : logging.Logger | None = None, level : int = logging.INFO ):
+		self.logger = logger or logging.getLogger('metrics')
+		self.level = level
+
+	def write( self, snapshot : dict ) -> None:
+		for stage, value in snapshot['timers'].items():
+			self.logger.log( self.level, '%s: %.6fs over %d calls', stage, value['seconds'], value['count'] )
+		for name, value in snapshot['counters'].items():
+			self.logger.log( self.level, '%s: %s', name, value )
+
+class JsonFileSink:
+
+	filepath : str
+
+	def __init__( self, filepath : str ):
+		self.filepath = filepath
+
+	def write( self, snapshot : dict ) -> None:
+		data = { 'counters' : snapshot['counters'], 'timers' : snapshot['timers'] }
+		with open( self.filepath, 'w' ) as file:
+			file.write( json.dumps( data, indent=4 ) )
+
+class PrometheusSink:
+	'''Prometheus text exposition format, counters as <prefix>_<name> and stages as <prefix>_stage_seconds_total{stage}.'''
+
+	filepath : str
+	prefix : str
+
+	def __init__( self, filepath : str, prefix : str = 'mcrr' ):
+		self.filepath = filepath
+		self.prefix = prefix
+
+	def render( self, snapshot : dict ) -> str:
+		lines = [ ]
+		declared = set()
+		for name, value in sorted( snapshot['counters'].items() ):
+			metric = f'{self.prefix}_{name.split("{")[0]}'
+			if metric not in declared:
+				declared.add( metric )
+				lines.append( f'# TYPE {metric} counter' )
+			lines.append( f'{self.prefix}_{name} {value}' )
+		if len(snapshot['timers']) != 0:
+			lines.append( f'# TYPE {self.prefix}_stage_seconds_total counter' )
+			for stage, value in sorted( snapshot['timers'].items() ):
+				lines.append( f'{self.prefix}_stage_seconds_total{{stage="{stage}"}} {value["seconds"]}' )
+			lines.append( f'# TYPE {self.prefix}_stage_calls_total counter' )
+			for stage, value in sorted( snapshot['timers'].items() ):
+				lines.append( f'{self.prefix}_stage_calls_total{{stage="{stage}"}} {value["count"]}' )
+		return '\n'.join( lines ) + '\n'
+
+	def write( self, snapshot : dict ) -> None:
+		with open( self.filepath, 'w' ) as file:
+			file.write( self.render( snapshot ) )
+
+METRICS = Metrics()
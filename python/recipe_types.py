@@ -0,0 +1,209 @@
+
+from __future__ import annotations
+
+import re
+import sys
+
+from typing import Any, Callable
+
+from utility import cache_increment_index
+
+RECIPE_PATH = re.compile( r'data/([^/]+)/recipes/(.+)\.json$' )
+
+def recipe_id_of( filepath : str | None ) -> str | None:
+	'''Resource id of a recipe file, e.g. data/minecraft/recipes/iron_ingot_from_blasting.json -> minecraft:iron_ingot_from_blasting.'''
+	if filepath == None:
+		return None
+	match = RECIPE_PATH.search( filepath.replace('\\', '/') )
+	if match == None:
+		return None
+	namespace, path = match.groups()
+	return f'{namespace}:{path}'
+
+class Ingredient:
+	'''An (item or "#" tag, count) pair. Instances are immutable and shared, build them through ingredient_of.'''
+
+	__slots__ = ( 'name', 'count' )
+
+	name : str
+	count : int
+
+	def __init__( self, name : str, count : int ):
+		self.name = sys.intern( name )
+		self.count = count
+
+	def __eq__( self, other : Any ) -> bool:
+		return type(other) == Ingredient and self.name == other.name and self.count == other.count
+
+	def __hash__( self ) -> int:
+		return hash( (self.name, self.count) )
+
+	def __repr__( self ) -> str:
+		return f'Ingredient({self.name!r}, {self.count})'
+
+	def __reduce__( self ) -> tuple:
+		return ingredient_of, ( self.name, self.count )
+
+INGREDIENTS : dict[tuple[str, int], Ingredient] = { }
+
+def ingredient_of( name : str, count : int ) -> Ingredient:
+	key = (name, count)
+	ingredient = INGREDIENTS.get( key )
+	if ingredient == None:
+		ingredient = INGREDIENTS[key] = Ingredient( name, count )
+	return ingredient
+
+class Recipe:
+	'''
+	A recipe normalised at ingest, its output is the key it is stored under.
+
+	Type and station strings are interned so every recipe of a type shares them, ingredients
+	are shared Ingredient instances. id is the resource id of the recipe file (namespace:path),
+	None when the recipe did not come from a jar entry. to_json() gives the
+	[ type, station, { ingredient : count }, amount, id ] form used by the exports and the on-disk index.
+	'''
+
+	__slots__ = ( 'type', 'station', 'ingredients', 'amount', 'id' )
+
+	type : str
+	station : str
+	ingredients : tuple[Ingredient, ...]
+	amount : int
+	id : str | None
+
+	def __init__( self, type_name : str, station : str, ingredients : tuple[Ingredient, ...], amount : int, recipe_id : str | None = None ):
+		self.type = sys.intern( type_name )
+		self.station = sys.intern( station )
+		self.ingredients = ingredients
+		self.amount = amount
+		self.id = recipe_id
+
+	@classmethod
+	def from_counts( cls, type_name : str, station : str, counts : dict[str, int], amount : int, recipe_id : str | None = None ) -> Recipe:
+		return cls( type_name, station, tuple( ingredient_of( name, count ) for name, count in counts.items() ), amount, recipe_id )
+
+	@classmethod
+	def from_json( cls, data : list ) -> Recipe:
+		return cls.from_counts( data[0], data[1], data[2], data[3], data[4] if len(data) > 4 else None )
+
+	def to_json( self ) -> list:
+		return [ self.type, self.station, self.counts(), self.amount, self.id ]
+
+	def counts( self ) -> dict[str, int]:
+		return { ingredient.name : ingredient.count for ingredient in self.ingredients }
+
+	def __eq__( self, other : Any ) -> bool:
+		return type(other) == Recipe and self.type == other.type and self.station == other.station and self.ingredients == other.ingredients and self.amount == other.amount and self.id == other.id
+
+	def __hash__( self ) -> int:
+		return hash( (self.type, self.station, self.ingredients, self.amount, self.id) )
+
+	def __repr__( self ) -> str:
+		return f'Recipe({self.type!r}, {self.station!r}, {self.counts()!r}, {self.amount}, {self.id!r})'
+
+	def __reduce__( self ) -> tuple:
+		return Recipe, ( self.type, self.station, self.ingredients, self.amount, self.id )
+
+def recipe_size( recipe : Recipe, seen : set[int] ) -> int:
+	'''Bytes held by the recipe, shared ingredients and strings are only counted the first time they are seen.'''
+	total = sys.getsizeof( recipe ) + sys.getsizeof( recipe.ingredients )
+	if recipe.id != None:
+		total += sys.getsizeof( recipe.id )
+	for value in ( recipe.type, recipe.station, *recipe.ingredients ):
+		if id(value) in seen: continue
+		seen.add( id(value) )
+		total += sys.getsizeof( value )
+		if type(value) == Ingredient and id(value.name) not in seen:
+			seen.add( id(value.name) )
+			total += sys.getsizeof( value.name )
+	return total
+
+RecipeHandler = Callable[[dict], tuple[str, dict[str, int], int] | None]
+
+# type -> (handler, station), handlers return (output, ingredients, amount) or None to skip the recipe
+RECIPE_HANDLERS : dict[str, tuple[RecipeHandler, str]] = { }
+
+SMELTING = [
+	'minecraft:smelting', 'minecraft:blasting', 'minecraft:smoking'
+]
+
+def ingredient_name( ingredient : Any ) -> str | None:
+	'''Name of an ingredient json value, tags are prefixed with "#" and alternatives resolve to the first one.'''
+	if type(ingredient) == str:
+		return ingredient
+	if type(ingredient) == list:
+		return ingredient_name( ingredient[0] ) if len(ingredient) != 0 else None
+	if type(ingredient) == dict:
+		if ingredient.get('item') != None:
+			return ingredient.get('item')
+		if ingredient.get('tag') != None:
+			return '#' + ingredient.get('tag')
+	return None
+
+def result_of( result : Any, count : int | None = None ) -> tuple[str | None, int]:
+	'''(item, count) of a result, either a plain id or { "item" : ..., "count" : ... }.'''
+	if type(result) == dict:
+		return result.get('item') or result.get('id'), result.get('count') or count or 1
+	return result if type(result) == str else None, count or 1
+
+def count_ingredients( ingredients : list ) -> dict[str, int]:
+	counts = { }
+	for ingredient in ingredients:
+		name = ingredient_name( ingredient )
+		if name != None and name != 'minecraft:air':
+			cache_increment_index( counts, name, 1 )
+	return counts
+
+def register_recipe_type( type_name : str, handler : RecipeHandler, station : str ) -> None:
+	'''Register or replace the handler of a recipe type, mods add their own types here.'''
+	RECIPE_HANDLERS[type_name] = (handler, station)
+
+def station_of( type_name : str ) -> str | None:
+	entry = RECIPE_HANDLERS.get( type_name )
+	return entry[1] if entry != None else None
+
+def normalise_recipe( data : dict, recipe_id : str | None = None ) -> tuple[str, Recipe] | None:
+	'''(output, recipe) of a recipe json with the given resource id, None when its type has no handler or it has no output.'''
+	entry = RECIPE_HANDLERS.get( data.get('type') )
+	if entry == None:
+		return None
+	handler, station = entry
+	normalised = handler( data )
+	if normalised == None or normalised[0] == None:
+		return None
+	output, ingredients, amount = normalised
+	return output, Recipe.from_counts( data.get('type'), station, ingredients, amount, recipe_id )
+
+def handle_shapeless( data : dict ) -> tuple[str, dict[str, int], int] | None:
+	output, amount = result_of( data.get('result') )
+	return output, count_ingredients( data.get('ingredients') or [ ] ), amount
+
+def handle_shaped( data : dict ) -> tuple[str, dict[str, int], int] | None:
+	output, amount = result_of( data.get('result') )
+	key = data.get('key') or { }
+	return output, count_ingredients( [ key.get(character) for row in data.get('pattern') or [ ] for character in row if character != ' ' ] ), amount
+
+def handle_single( data : dict ) -> tuple[str, dict[str, int], int] | None:
+	'''Cooking and stonecutting, one ingredient with the count beside the result.'''
+	output, amount = result_of( data.get('result'), data.get('count') )
+	return output, count_ingredients( [ data.get('ingredient') ] ), amount
+
+def handle_smithing( data : dict ) -> tuple[str, dict[str, int], int] | None:
+	'''Legacy smithing (base + addition) and smithing_transform (template + base + addition).'''
+	output, amount = result_of( data.get('result') )
+	return output, count_ingredients( [ data.get(slot) for slot in ( 'template', 'base', 'addition' ) if data.get(slot) != None ] ), amount
+
+register_recipe_type( 'minecraft:crafting_shapeless', handle_shapeless, 'crafting_table' )
+register_recipe_type( 'minecraft:crafting_shaped', handle_shaped, 'crafting_table' )
+register_recipe_type( 'minecraft:smelting', handle_single, 'furnace' )
+register_recipe_type( 'minecraft:blasting', handle_single, 'blast_furnace' )
+register_recipe_type( 'minecraft:smoking', handle_single, 'smoker' )
+register_recipe_type( 'minecraft:campfire_cooking', handle_single, 'campfire' )
+register_recipe_type( 'minecraft:stonecutting', handle_single, 'stonecutter' )
+register_recipe_type( 'minecraft:smithing', handle_smithing, 'smithing_table' )
+register_recipe_type( 'minecraft:smithing_transform', handle_smithing, 'smithing_table' )
+
+register_recipe_type( 'computercraft:turtle', handle_shaped, 'crafting_table' )
+register_recipe_type( 'computercraft:computer_upgrade', handle_shaped, 'crafting_table' )
+register_recipe_type( 'computercraft:impostor_shaped', handle_shaped, 'crafting_table' )
+register_recipe_type( 'computercraft:impostor_shapeless', handle_shapeless, 'crafting_table' )
@@ -1,3 +1,285 @@
 
+from __future__ import annotations
 
-from sources import ( CRAFTING_TYPES, extract_sources_from_files )
+import json
+import heapq
+
+from math import ceil
+
+from sources import extract_sources_from_files
+from graph import RecipeGraph
+from recipe_types import SMELTING, station_of
+from utility import cache_increment_index
+from metrics import METRICS
+
+# the raw material the fuel of every 8 smelts is counted as, as in the original resolver
+FUEL_ITEM = 'minecraft:coal_ore'
+
+def chosen_recipe( graph : RecipeGraph, item : int ) -> int:
+	'''The recipe used for the item, chosen at load time so that it never loops back to it (-1 for raw items).'''
+	return graph.chosen[item]
+
+def ingredient_span( graph : RecipeGraph, recipe : int ) -> tuple[int, int]:
+	if recipe == -1:
+		return 0, 0
+	return graph.ingredient_offsets[recipe], graph.ingredient_offsets[recipe + 1]
+
+def topological_order( graph : RecipeGraph, roots : list[int] ) -> list[int]:
+	'''
+	Items reachable from the roots through their chosen recipe, every item ordered before its ingredients.
+	Tags are replaced by their representative item. Chosen recipes never close a cycle, the
+	ValueError on a recursive recipe only guards against a graph that was not compiled.
+	'''
+	representative, ingredient_ids = graph.representative, graph.ingredient_ids
+
+	order = [ ]
+	state = { } # 1 = on the current path, 2 = finished
+	for root in roots:
+		root = representative[root]
+		if state.get( root ) != None:
+			continue
+		state[root] = 1
+		stack = [ (root, *ingredient_span( graph, chosen_recipe( graph, root ) )) ]
+		while len(stack) > 0:
+			item, index, end = stack[-1]
+			if index == end:
+				stack.pop()
+				state[item] = 2
+				order.append( item )
+				continue
+			stack[-1] = (item, index + 1, end)
+			child = representative[ ingredient_ids[index] ]
+			visited = state.get( child )
+			if visited == 2:
+				continue
+			if visited == 1:
+				raise ValueError('Recursive recipe detected! ' + graph.names[child])
+			state[child] = 1
+			stack.append( (child, *ingredient_span( graph, chosen_recipe( graph, child ) )) )
+	order.reverse()
+	return order
+
+def order_ids( graph : RecipeGraph, items : list[tuple[str, int]] ) -> tuple[dict[int, int], list[int]]:
+	demand = { }
+	roots = [ ]
+	for (item_id, amount) in items:
+		item = graph.id_of( item_id )
+		assert item != -1, f'Could not find the recipe for {item_id} because it does not exist!'
+		item = graph.representative[item]
+		cache_increment_index( demand, item, amount )
+		roots.append( item )
+	return demand, roots
+
+def plan_step( graph : RecipeGraph, item : int, recipe : int, crafts : int, required : int, smelting : bool ) -> dict:
+	'''
+	One json serialisable step of a plan, the ingredients are totals for every batch.
+	recipe is the resource id of the recipe, stable across reloads, recipe_index its position in this graph only.
+	'''
+	type_name = graph.types[ graph.recipe_type[recipe] ]
+	produced = crafts * graph.recipe_count[recipe]
+	ingredients = { }
+	for index in range( graph.ingredient_offsets[recipe], graph.ingredient_offsets[recipe + 1] ):
+		cache_increment_index( ingredients, graph.names[ graph.representative[ graph.ingredient_ids[index] ] ], crafts * graph.ingredient_counts[index] )
+	return {
+		'item' : graph.names[item],
+		'action' : 'smelt' if smelting else 'craft',
+		'recipe' : graph.recipe_names[recipe],
+		'recipe_index' : recipe,
+		'type' : type_name,
+		'station' : station_of( type_name ),
+		'batches' : crafts,
+		'produced' : produced,
+		'surplus' : produced - required,
+		'ingredients' : ingredients,
+	}
+
+def resolve_orders( graph : RecipeGraph, items : list[tuple[str, int]], inventory : dict[str, int] | None = None, plan : list[dict] | None = None ) -> tuple[dict, int]:
+	'''
+	Resolve a whole order list in one sweep of the graph.
+
+	Demand is accumulated per item in topological order so every item is visited once and
+	the ceil batch rounding is applied once on its total demand, shared subtrees are never re-walked.
+	With an inventory { item : amount }, intermediates and raw materials in stock are consumed
+	before expanding further (the ordered items themselves are always made).
+	With a plan list, the craft and smelt steps are appended to it in the order they can be
+	carried out, every ingredient is made before the items that use it.
+	'''
+	METRICS.increment('resolves')
+	with METRICS.timer('resolve'):
+		ordered, roots = order_ids( graph, items )
+		demand = { }
+		inventory = inventory or { }
+
+		names, representative, recipe_count = graph.names, graph.representative, graph.recipe_count
+		ingredient_offsets, ingredient_ids, ingredient_counts = graph.ingredient_offsets, graph.ingredient_ids, graph.ingredient_counts
+		smelting_types = set( index for index, name in enumerate(graph.types) if name in SMELTING )
+
+		total_resources = { }
+		total_smelts = 0
+		steps = [ ]
+		for item in topological_order( graph, roots ):
+			required = ordered.get( item, 0 ) + max( 0, demand.get( item, 0 ) - inventory.get( names[item], 0 ) )
+			if required <= 0:
+				continue
+			recipe = chosen_recipe( graph, item )
+			if recipe == -1:
+				total_resources[names[item]] = required
+				continue
+			crafts = ceil( required / recipe_count[recipe] )
+			smelting = graph.recipe_type[recipe] in smelting_types
+			if smelting:
+				total_smelts += crafts
+			for index in range( ingredient_offsets[recipe], ingredient_offsets[recipe + 1] ):
+				cache_increment_index( demand, representative[ ingredient_ids[index] ], crafts * ingredient_counts[index] )
+			if plan != None:
+				steps.append( plan_step( graph, item, recipe, crafts, required, smelting ) )
+		if plan != None:
+			steps.reverse()
+			plan.extend( steps )
+	return total_resources, total_smelts
+
+def resolve_recipe_tree( graph : RecipeGraph, target_id : str, total_amount : int ) -> tuple[dict, int]:
+	'''Resolve the raw resources and number of smelts needed to make total_amount of target_id.'''
+	root = graph.id_of( target_id )
+	assert root != -1, 'Could not find the recipe because it does not exist!'
+	assert graph.has_recipe( graph.representative[root] ), 'The recipe is not a craftable item!'
+	return resolve_orders( graph, [ (target_id, total_amount) ] )
+
+def resolve_multi_tree( graph : RecipeGraph, items : list[tuple[str, int]], include_fuel : bool = True, inventory : dict[str, int] | None = None ) -> tuple[dict, int]:
+	total_resources, total_smelts = resolve_orders( graph, items, inventory )
+	if include_fuel == True:
+		cache_increment_index( total_resources, FUEL_ITEM, ceil(total_smelts / 8) )
+	return total_resources, total_smelts
+
+def resolve_plan( graph : RecipeGraph, items : list[tuple[str, int]], include_fuel : bool = True, inventory : dict[str, int] | None = None ) -> dict:
+	'''Raw resources, smelts and the ordered craft and smelt steps of an order list, as one json serialisable dict.'''
+	steps = [ ]
+	total_resources, total_smelts = resolve_orders( graph, items, inventory, steps )
+	if include_fuel == True:
+		cache_increment_index( total_resources, FUEL_ITEM, ceil(total_smelts / 8) )
+	return { 'resources' : total_resources, 'smelts' : total_smelts, 'steps' : steps }
+
+class InventoryPlan:
+	'''
+	Resolution of an order list against a live inventory snapshot.
+
+	Keeps the derived demand and number of crafts of every reachable item, when the inventory
+	changes only the changed items and the descendants whose crafts actually move are recomputed,
+	walked in topological order so every item is settled once per update.
+	'''
+
+	graph : RecipeGraph
+	ordered : dict[int, int]
+	order : list[int]
+	position : dict[int, int]
+	inventory : dict[str, int]
+	demand : dict[int, int]
+	crafts : dict[int, int]
+	total_smelts : int
+
+	def __init__( self, graph : RecipeGraph, items : list[tuple[str, int]], inventory : dict[str, int] | None = None ):
+		self.graph = graph
+		self.ordered, roots = order_ids( graph, items )
+		self.order = topological_order( graph, roots )
+		self.position = { item : index for index, item in enumerate(self.order) }
+		self.inventory = dict( inventory or { } )
+		self.demand = { }
+		self.crafts = { }
+		self.total_smelts = 0
+		self.smelting_types = set( index for index, name in enumerate(graph.types) if name in SMELTING )
+		self.propagate( self.order )
+
+	def required( self, item : int ) -> int:
+		stock = self.inventory.get( self.graph.names[item], 0 )
+		return self.ordered.get( item, 0 ) + max( 0, self.demand.get( item, 0 ) - stock )
+
+	def propagate( self, items : list[int] ) -> None:
+		graph = self.graph
+		heap = [ (self.position[item], item) for item in items if item in self.position ]
+		heapq.heapify( heap )
+		settled = set()
+		while len(heap) > 0:
+			_, item = heapq.heappop( heap )
+			if item in settled: continue
+			settled.add( item )
+			recipe = chosen_recipe( graph, item )
+			if recipe == -1:
+				continue
+			crafts = ceil( self.required( item ) / graph.recipe_count[recipe] )
+			delta = crafts - self.crafts.get( item, 0 )
+			if delta == 0:
+				continue
+			self.crafts[item] = crafts
+			if graph.recipe_type[recipe] in self.smelting_types:
+				self.total_smelts += delta
+			for index in range( graph.ingredient_offsets[recipe], graph.ingredient_offsets[recipe + 1] ):
+				child = graph.representative[ graph.ingredient_ids[index] ]
+				cache_increment_index( self.demand, child, delta * graph.ingredient_counts[index] )
+				heapq.heappush( heap, (self.position[child], child) )
+
+	def set_inventory( self, inventory : dict[str, int] ) -> None:
+		'''Replace the snapshot, only the items whose stock differs are recomputed.'''
+		changed = { }
+		for name in set( self.inventory.keys() ) | set( inventory.keys() ):
+			if self.inventory.get( name, 0 ) != inventory.get( name, 0 ):
+				changed[name] = inventory.get( name, 0 )
+		self.update_inventory( changed )
+
+	def update_inventory( self, changes : dict[str, int] ) -> None:
+		'''Set the stock of a few items and update the plan from the previous solution.'''
+		dirty = [ ]
+		for name, amount in changes.items():
+			self.inventory[name] = amount
+			item = self.graph.id_of( name )
+			if item != -1: dirty.append( item )
+		self.propagate( dirty )
+
+	def resources( self ) -> dict[str, int]:
+		total_resources = { }
+		for item in self.order:
+			if chosen_recipe( self.graph, item ) != -1: continue
+			required = self.required( item )
+			if required > 0: total_resources[ self.graph.names[item] ] = required
+		return total_resources
+
+	def consumed( self ) -> dict[str, int]:
+		'''Stock taken from the inventory by the plan.'''
+		used = { }
+		for item in self.order:
+			name = self.graph.names[item]
+			amount = min( self.demand.get( item, 0 ), self.inventory.get( name, 0 ) )
+			if amount > 0: used[name] = amount
+		return used
+
+	def steps( self ) -> list[dict]:
+		'''The craft and smelt steps of the current solution, ingredients first.'''
+		steps = [ ]
+		for item in reversed( self.order ):
+			crafts = self.crafts.get( item, 0 )
+			if crafts <= 0: continue
+			recipe = chosen_recipe( self.graph, item )
+			steps.append( plan_step( self.graph, item, recipe, crafts, self.required( item ), self.graph.recipe_type[recipe] in self.smelting_types ) )
+		return steps
+
+	def result( self, include_fuel : bool = True ) -> tuple[dict, int]:
+		total_resources = self.resources()
+		if include_fuel == True:
+			cache_increment_index( total_resources, FUEL_ITEM, ceil(self.total_smelts / 8) )
+		return total_resources, self.total_smelts
+
+if __name__ == '__main__':
+
+	graph = RecipeGraph.from_sources( extract_sources_from_files([
+		'temp/forge-40.2.0.jar',
+	], index_filepath='mc-src-info/index.bin') )
+
+	print(f'{graph.recipe_total} recipes, {graph.item_count} items, {graph.memory_size()} bytes.')
+
+	plan = resolve_plan(graph, [
+		('minecraft:iron_pickaxe', 1),
+		('minecraft:furnace', 3),
+	])
+
+	print( json.dumps(plan['resources'], indent=4) )
+	for step in plan['steps']:
+		print(f"{step['action']} {step['produced']}x {step['item']} in {step['batches']} batches ({step['surplus']} left over)")
@@ -0,0 +1,223 @@
+
+from __future__ import annotations
+
+import json
+import asyncio
+import logging
+import argparse
+import traceback
+
+from math import ceil
+from urllib.parse import urlsplit, parse_qs
+
+from sources import extract_sources_from_files
+from graph import RecipeGraph
+from bulk import BillOfMaterials
+from watch import SourceWatcher
+from resolver import FUEL_ITEM, resolve_plan
+
+logger = logging.getLogger(__name__)
+
+def order_items( data : dict ) -> list[tuple[str, int]]:
+	'''The [ [ item, amount ], ... ] order list of a request body, amounts must be positive.'''
+	items = [ (item_id, int(amount)) for item_id, amount in data.get('items', [ ]) ]
+	for item_id, amount in items:
+		if amount <= 0:
+			raise ValueError(f'The amount of {item_id} must be positive, got {amount}')
+	return items
+
+class RecipeService:
+	'''
+	Long running query service over a hot, in-memory recipe index.
+
+	Speaks a minimal HTTP/1.1 (one request per connection) on localhost or a Unix socket:
+		POST /resolve  { "items" : [ [ item, amount ], ... ], "include_fuel" : true }
+		POST /plan     { "items" : [ [ item, amount ], ... ], "include_fuel" : true, "inventory" : { item : amount } }
+		GET  /lookup?item=minecraft:stick
+		GET  /usage?item=minecraft:stick
+		GET  /downstream?item=minecraft:iron_ore
+	Resolve requests arriving in the same event loop tick are coalesced into one batched sweep.
+	When following a SourceWatcher, reloaded graphs are prepared on the watcher thread and
+	installed on the event loop in one step, between requests.
+	'''
+
+	graph : RecipeGraph
+	bulk : BillOfMaterials
+	pending : list[tuple[list, bool, asyncio.Future]]
+	flush_scheduled : bool
+
+	def __init__( self, graph : RecipeGraph ):
+		self.install( self.prepare( graph ) )
+		self.pending = [ ]
+		self.flush_scheduled = False
+
+	@staticmethod
+	def prepare( graph : RecipeGraph ) -> tuple[RecipeGraph, BillOfMaterials]:
+		'''Everything derived from a graph, built off the event loop before it is installed.'''
+		return graph, BillOfMaterials( graph )
+
+	def install( self, prepared : tuple[RecipeGraph, BillOfMaterials] ) -> None:
+		self.graph, self.bulk = prepared
+
+	def follow( self, watcher : SourceWatcher ) -> None:
+		'''Install every graph the watcher reloads, must be called from the event loop that serves requests.'''
+		loop = asyncio.get_running_loop()
+		watcher.listeners.append( lambda sources, graph : loop.call_soon_threadsafe( self.install, self.prepare( graph ) ) )
+
+	@classmethod
+	def from_files( cls, filepaths : list[str], index_filepath : str | None = None, workers : int = 1 ) -> RecipeService:
+		return cls( RecipeGraph.from_sources( extract_sources_from_files( filepaths, workers=workers, index_filepath=index_filepath ) ) )
+
+	def describe_recipe( self, recipe : int ) -> dict:
+		graph = self.graph
+		start, end = graph.ingredient_offsets[recipe], graph.ingredient_offsets[recipe + 1]
+		return {
+			'id' : recipe,
+			'recipe' : graph.recipe_names[recipe],
+			'type' : graph.types[ graph.recipe_type[recipe] ],
+			'output' : graph.names[ graph.recipe_output[recipe] ],
+			'count' : graph.recipe_count[recipe],
+			'ingredients' : { graph.names[ graph.ingredient_ids[index] ] : graph.ingredient_counts[index] for index in range( start, end ) },
+		}
+
+	def lookup( self, name : str ) -> dict:
+		item = self.graph.id_of( name )
+		if item == -1:
+			raise KeyError(f'Unknown item {name}')
+		item = self.graph.representative[item]
+		return {
+			'item' : self.graph.names[item],
+			'chosen' : self.graph.chosen[item],
+			'recipes' : [ self.describe_recipe( recipe ) for recipe in self.graph.recipes_of( item ) ],
+		}
+
+	def usage( self, name : str ) -> dict:
+		item = self.graph.id_of( name )
+		if item == -1:
+			raise KeyError(f'Unknown item {name}')
+		return { 'item' : name, 'recipes' : [ self.describe_recipe( recipe ) for recipe in self.graph.used_in( item ) ] }
+
+	def downstream( self, name : str ) -> dict:
+		item = self.graph.id_of( name )
+		if item == -1:
+			raise KeyError(f'Unknown item {name}')
+		return { 'item' : name, 'downstream' : [ self.graph.names[output] for output in self.graph.downstream( item ) ] }
+
+	async def resolve( self, items : list[tuple[str, int]], include_fuel : bool = True ) -> dict:
+		for item_id, amount in items:
+			if self.graph.id_of( item_id ) == -1:
+				raise KeyError(f'Unknown item {item_id}')
+			if amount <= 0:
+				raise ValueError(f'The amount of {item_id} must be positive, got {amount}')
+		loop = asyncio.get_running_loop()
+		future = loop.create_future()
+		self.pending.append( (items, include_fuel, future) )
+		if self.flush_scheduled == False:
+			self.flush_scheduled = True
+			loop.call_soon( self.flush )
+		return await future
+
+	def flush( self ) -> None:
+		'''Resolve every request queued during this tick in one sweep.'''
+		batch, self.pending, self.flush_scheduled = self.pending, [ ], False
+		try:
+			names, amounts, smelts = self.bulk.query_order_lists( [ items for items, _, _ in batch ] )
+		except Exception as exception:
+			for _, _, future in batch:
+				if not future.done(): future.set_exception( exception )
+			return
+		for column, (_, include_fuel, future) in enumerate(batch):
+			resources = { names[row] : int(amount) for row, amount in enumerate( amounts[column] ) if amount != 0 }
+			total_smelts = int( smelts[column] )
+			if include_fuel == True:
+				resources[FUEL_ITEM] = resources.get(FUEL_ITEM, 0) + ceil(total_smelts / 8)
+			if not future.done():
+				future.set_result( { 'resources' : resources, 'smelts' : total_smelts, 'batch' : len(batch) } )
+
+	async def handle( self, method : str, target : str, body : bytes ) -> tuple[int, dict]:
+		url = urlsplit( target )
+		query = parse_qs( url.query )
+		if method == 'POST' and url.path == '/resolve':
+			data = json.loads( body or b'{}' )
+			items = order_items( data )
+			return 200, await self.resolve( items, data.get('include_fuel', True) == True )
+		if method == 'POST' and url.path == '/plan':
+			data = json.loads( body or b'{}' )
+			items = order_items( data )
+			for item_id, _ in items:
+				if self.graph.id_of( item_id ) == -1:
+					raise KeyError(f'Unknown item {item_id}')
+			return 200, resolve_plan( self.graph, items, data.get('include_fuel', True) == True, data.get('inventory') )
+		if method == 'GET' and url.path == '/lookup':
+			return 200, self.lookup( query.get('item', [ '' ])[0] )
+		if method == 'GET' and url.path == '/usage':
+			return 200, self.usage( query.get('item', [ '' ])[0] )
+		if method == 'GET' and url.path == '/downstream':
+			return 200, self.downstream( query.get('item', [ '' ])[0] )
+		return 404, { 'error' : f'No route for {method} {url.path}' }
+
+	async def on_connection( self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter ) -> None:
+		try:
+			request_line = ( await reader.readline() ).decode('latin-1').split()
+			if len(request_line) < 2:
+				return
+			method, target = request_line[0], request_line[1]
+			length = 0
+			while True:
+				line = ( await reader.readline() ).decode('latin-1').strip()
+				if line == '': break
+				header, _, value = line.partition(':')
+				if header.lower() == 'content-length': length = int( value.strip() )
+			body = await reader.readexactly( length ) if length > 0 else b''
+			try:
+				status, response = await self.handle( method, target, body )
+			except KeyError as exception:
+				status, response = 404, { 'error' : str(exception.args[0]) }
+			except Exception as exception:
+				status, response = 400, { 'error' : ''.join( traceback.format_exception_only( exception ) ).strip() }
+			payload = json.dumps( response, separators=(',', ':') ).encode('utf-8')
+			writer.write(
+				f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\n'.encode('latin-1') +
+				b'Content-Type: application/json\r\n' +
+				f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode('latin-1') +
+				payload
+			)
+			await writer.drain()
+		finally:
+			writer.close()
+
+	async def serve( self, host : str = '127.0.0.1', port : int = 8765, unix_path : str | None = None, watcher : SourceWatcher | None = None, interval : float = 0.25 ) -> None:
+		if watcher != None:
+			self.follow( watcher )
+			watcher.start( interval )
+		if unix_path != None:
+			server = await asyncio.start_unix_server( self.on_connection, path=unix_path )
+			logger.info('Serving recipes on unix socket %s.', unix_path)
+		else:
+			server = await asyncio.start_server( self.on_connection, host=host, port=port )
+			logger.info('Serving recipes on http://%s:%d.', host, port)
+		async with server:
+			await server.serve_forever()
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser( description='Serve recipe queries from a hot in-memory index.' )
+	parser.add_argument( 'jars', nargs='+', help='jar files, most important first' )
+	parser.add_argument( '--index', default='mc-src-info/index.bin' )
+	parser.add_argument( '--workers', type=int, default=1 )
+	parser.add_argument( '--host', default='127.0.0.1' )
+	parser.add_argument( '--port', type=int, default=8765 )
+	parser.add_argument( '--unix', default=None, help='serve on a unix socket instead of tcp' )
+	parser.add_argument( '--watch', action='store_true', help='reload changed jars while serving, jars may be mod directories' )
+	parser.add_argument( '--interval', type=float, default=0.25 )
+	arguments = parser.parse_args()
+
+	logging.basicConfig( level=logging.INFO )
+	if arguments.watch == True:
+		watcher = SourceWatcher( arguments.jars, index_filepath=arguments.index, workers=arguments.workers )
+		watcher.poll()
+		service = RecipeService( watcher.graph )
+		asyncio.run( service.serve( arguments.host, arguments.port, arguments.unix, watcher, arguments.interval ) )
+	else:
+		service = RecipeService.from_files( arguments.jars, index_filepath=arguments.index, workers=arguments.workers )
+		asyncio.run( service.serve( arguments.host, arguments.port, arguments.unix ) )
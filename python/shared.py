@@ -0,0 +1,149 @@
+
+from __future__ import annotations
+
+import os
+
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Iterable, Iterator
+
+from graph import RecipeGraph
+from resolver import resolve_multi_tree
+from metrics import METRICS
+
+# the arrays resolve_multi_tree reads, all array('i')
+SHARED_FIELDS = (
+	'recipe_output', 'recipe_count', 'recipe_type',
+	'ingredient_offsets', 'ingredient_ids', 'ingredient_counts',
+	'recipe_offsets', 'recipe_ids', 'representative', 'chosen',
+)
+
+class SharedGraph:
+	'''
+	Read only copy of the arrays and names of a compiled RecipeGraph in one shared memory block.
+
+	layout is small and picklable, { 'arrays' : { field : (offset, count) }, 'names' : (offset, size), 'recipe_names' : (offset, size), 'types' : [ ... ] },
+	a process attaches with attach() and gets a RecipeGraph whose arrays are views into the block.
+	'''
+
+	memory : shared_memory.SharedMemory
+	layout : dict
+
+	def __init__( self, memory : shared_memory.SharedMemory, layout : dict ):
+		self.memory = memory
+		self.layout = layout
+
+	@property
+	def name( self ) -> str:
+		return self.memory.name
+
+	@classmethod
+	def create( cls, graph : RecipeGraph ) -> SharedGraph:
+		names = '\0'.join( graph.names ).encode('utf-8')
+		recipe_names = '\0'.join( name or '' for name in graph.recipe_names ).encode('utf-8')
+		arrays = { }
+		offset = 0
+		for field in SHARED_FIELDS:
+			values = getattr( graph, field )
+			arrays[field] = (offset, len(values))
+			offset += len(values) * 4
+			offset += -offset % 8
+		layout = { 'arrays' : arrays, 'names' : (offset, len(names)), 'recipe_names' : (offset + len(names), len(recipe_names)), 'types' : list( graph.types ) }
+
+		memory = shared_memory.SharedMemory( create=True, size=max( 1, offset + len(names) + len(recipe_names) ) )
+		for field, (start, count) in arrays.items():
+			values = getattr( graph, field )
+			if type(values) != array: values = array( 'i', values )
+			memory.buf[ start : start + count * 4 ] = values.tobytes()
+		memory.buf[ offset : offset + len(names) ] = names
+		memory.buf[ offset + len(names) : offset + len(names) + len(recipe_names) ] = recipe_names
+		return cls( memory, layout )
+
+	@staticmethod
+	def attach( name : str, layout : dict ) -> tuple[shared_memory.SharedMemory, RecipeGraph]:
+		'''Map the block in this process, keep the returned memory alive for as long as the graph is used.'''
+		# pool processes share the resource tracker of their parent, which unlinks the block in close()
+		memory = shared_memory.SharedMemory( name=name )
+		graph = RecipeGraph()
+		for field, (start, count) in layout['arrays'].items():
+			setattr( graph, field, memory.buf[ start : start + count * 4 ].cast('i') )
+		start, size = layout['names']
+		graph.names = bytes( memory.buf[ start : start + size ] ).decode('utf-8').split('\0') if size != 0 else [ ]
+		graph.ids = { item_name : index for index, item_name in enumerate( graph.names ) }
+		start, size = layout['recipe_names']
+		recipe_names = bytes( memory.buf[ start : start + size ] ).decode('utf-8').split('\0') if len(graph.recipe_output) != 0 else [ ]
+		graph.recipe_names = [ name if name != '' else None for name in recipe_names ]
+		graph.types = layout['types']
+		return memory, graph
+
+	def close( self ) -> None:
+		self.memory.close()
+		self.memory.unlink()
+
+	def __enter__( self ) -> SharedGraph:
+		return self
+
+	def __exit__( self, *args ) -> None:
+		self.close()
+
+# set in each pool process by attach_worker
+WORKER_MEMORY : shared_memory.SharedMemory | None = None
+WORKER_GRAPH : RecipeGraph | None = None
+
+def attach_worker( name : str, layout : dict ) -> None:
+	global WORKER_MEMORY, WORKER_GRAPH
+	WORKER_MEMORY, WORKER_GRAPH = SharedGraph.attach( name, layout )
+
+def resolve_chunk( job : tuple[list[list[tuple[str, int]]], bool] ) -> tuple[list, dict]:
+	'''Resolve a chunk of order lists against the attached graph, a failing order list gives its exception in place.'''
+	order_lists, include_fuel = job
+	before = METRICS.state()
+	results = [ ]
+	for items in order_lists:
+		try:
+			results.append( resolve_multi_tree( WORKER_GRAPH, items, include_fuel ) )
+		except Exception as exception:
+			results.append( exception )
+	return results, METRICS.delta( before )
+
+def chunked( values : Iterable, size : int ) -> Iterator[list]:
+	chunk = [ ]
+	for value in values:
+		chunk.append( value )
+		if len(chunk) == size:
+			yield chunk
+			chunk = [ ]
+	if len(chunk) != 0:
+		yield chunk
+
+def resolve_bulk( graph : RecipeGraph, order_lists : Iterable[list[tuple[str, int]]], workers : int = 0, chunk_size : int = 256, include_fuel : bool = True, return_exceptions : bool = False ) -> Iterator[tuple[dict, int] | Exception]:
+	'''
+	resolve_multi_tree over many order lists in a process pool, results are yielded in input order.
+
+	The graph is copied into shared memory once and every worker maps it when it starts, tasks
+	only carry their chunk of order lists. The input is consumed lazily with a bounded number of
+	chunks in flight. A failing order list raises, or is yielded as its exception with return_exceptions.
+	workers <= 0 uses every core.
+	'''
+	with SharedGraph.create( graph ) as shared:
+		workers = workers if workers > 0 else ( os.cpu_count() or 1 )
+		with ProcessPoolExecutor( max_workers=workers, initializer=attach_worker, initargs=( shared.name, shared.layout ) ) as executor:
+			limit = workers * 2
+			in_flight = deque()
+			chunks = chunked( order_lists, chunk_size )
+			while True:
+				while len(in_flight) < limit:
+					chunk = next( chunks, None )
+					if chunk == None: break
+					in_flight.append( executor.submit( resolve_chunk, (chunk, include_fuel) ) )
+				if len(in_flight) == 0:
+					break
+				results, delta = in_flight.popleft().result()
+				METRICS.merge( delta )
+				for result in results:
+					if isinstance( result, Exception ) and return_exceptions == False:
+						for future in in_flight: future.cancel()
+						raise result
+					yield result
@@ -0,0 +1,227 @@
+
+from __future__ import annotations
+
+import os
+import hashlib
+
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Iterator
+
+from sources import RecipeSourcesMatrix, extract_sources_from_files
+from recipe_types import Recipe
+from tags import TagIndex
+from graph import RecipeGraph, memory_report
+
+def nesting_parents( tags : TagIndex ) -> dict[tuple[str, str], list[tuple[str, str]]]:
+	'''For every tag, the tags that include it as a nested "#" value.'''
+	parents = { }
+	for (registry, name), values in tags.tags.items():
+		for value in values.keys():
+			if not value.startswith('#'): continue
+			nested = (registry, value[1:])
+			if parents.get( nested ) == None:
+				parents[nested] = [ (registry, name) ]
+			else:
+				parents[nested].append( (registry, name) )
+	return parents
+
+class LayeredRecipes( Mapping ):
+	'''
+	Read only recipes of an override layer over a base layer, the override wins per output item.
+	Iterates in the same order as merging the two layers into one dict would.
+	'''
+
+	base : dict[str, list[Recipe]]
+	overlay : dict[str, list[Recipe]]
+	added : list[str]
+
+	def __init__( self, base : dict[str, list[Recipe]], overlay : dict[str, list[Recipe]] ):
+		self.base = base
+		self.overlay = overlay
+		self.added = [ name for name in overlay.keys() if name not in base ]
+
+	def __getitem__( self, name : str ) -> list[Recipe]:
+		recipes = self.overlay.get( name )
+		return recipes if recipes != None else self.base[name]
+
+	def __contains__( self, name : object ) -> bool:
+		return name in self.overlay or name in self.base
+
+	def __iter__( self ) -> Iterator[str]:
+		yield from self.base.keys()
+		yield from self.added
+
+	def __len__( self ) -> int:
+		return len(self.base) + len(self.added)
+
+class LayeredTags( Mapping ):
+	'''Tag values of an override layer over a base layer, merged per key the way TagIndex.merge does.'''
+
+	base : TagIndex
+	overlay : TagIndex
+	added : list[tuple[str, str]]
+
+	def __init__( self, base : TagIndex, overlay : TagIndex ):
+		self.base = base
+		self.overlay = overlay
+		self.added = [ key for key in overlay.tags.keys() if key not in base.tags ]
+
+	def __getitem__( self, key : tuple[str, str] ) -> dict[str, None]:
+		values = self.overlay.tags.get( key )
+		if values == None:
+			return self.base.tags[key]
+		below = self.base.tags.get( key )
+		if key in self.overlay.replaced or below == None:
+			return values
+		merged = dict( below )
+		merged.update( values )
+		return merged
+
+	def __contains__( self, key : object ) -> bool:
+		return key in self.overlay.tags or key in self.base.tags
+
+	def __iter__( self ) -> Iterator[tuple[str, str]]:
+		yield from self.base.tags.keys()
+		yield from self.added
+
+	def __len__( self ) -> int:
+		return len(self.base.tags) + len(self.added)
+
+class LayeredTagIndex( TagIndex ):
+	'''
+	Read only TagIndex of an override layer over a compiled base layer.
+
+	Only the tags the override touches, and the base tags that nest one of them, are expanded
+	again, every other expansion is the shared tuple of the base layer.
+	'''
+
+	base : TagIndex
+	dirty : set[tuple[str, str]]
+
+	def __init__( self, base : TagIndex, overlay : TagIndex, parents : dict[tuple[str, str], list[tuple[str, str]]] ):
+		super().__init__()
+		self.base = base
+		self.tags = LayeredTags( base, overlay )
+		self.replaced = base.replaced | overlay.replaced
+		self.expanded = { }
+		self.dirty = set()
+		frontier = list( overlay.tags.keys() )
+		while len(frontier) > 0:
+			key = frontier.pop()
+			if key in self.dirty: continue
+			self.dirty.add( key )
+			frontier.extend( parents.get( key, () ) )
+
+	def add( self, registry : str, name : str, values : list | None, replace : bool = False ) -> None:
+		raise TypeError('Layered tags are read only, add to the override layer instead.')
+
+	def merge( self, other : TagIndex ) -> None:
+		raise TypeError('Layered tags are read only, merge into the override layer instead.')
+
+	def compile( self ) -> None:
+		for key in self.dirty:
+			self.expand_key( key, set() )
+
+	def expand_key( self, key : tuple[str, str], visiting : set ) -> tuple[str, ...]:
+		if key not in self.dirty:
+			return self.base.expand( key[1], key[0] )
+		return super().expand_key( key, visiting )
+
+	def expand( self, name : str, registry : str = 'items' ) -> tuple[str, ...]:
+		return self.expand_key( (registry, name), set() )
+
+class LayeredSources:
+	'''A modpack as an override layer over a shared base layer, usable wherever a RecipeSourcesMatrix is read.'''
+
+	base : RecipeSourcesMatrix
+	overlay : RecipeSourcesMatrix
+	recipes : LayeredRecipes
+	tags : LayeredTagIndex
+	unsupported : dict
+	failed : dict
+
+	def __init__( self, base : RecipeSourcesMatrix, overlay : RecipeSourcesMatrix, parents : dict[tuple[str, str], list[tuple[str, str]]] ):
+		self.base = base
+		self.overlay = overlay
+		self.recipes = LayeredRecipes( base.recipes, overlay.recipes )
+		self.tags = LayeredTagIndex( base.tags, overlay.tags, parents )
+		self.unsupported = { **base.unsupported, **overlay.unsupported }
+		self.failed = { **base.failed, **overlay.failed }
+
+class SnapshotStore:
+	'''
+	Recipe sources of many modpacks sharing parsed base layers.
+
+	A base (e.g. vanilla + forge) is parsed once per distinct list of jars and kept as an immutable
+	layer, each pack only parses and stores its own jars as an override layer. Lookups fall through
+	from the pack to its base, so memory grows with what the packs add rather than with their count.
+	Compiled graphs are per pack and kept in a small LRU.
+	'''
+
+	index_directory : str | None
+	workers : int
+	bases : dict[tuple[str, ...], tuple[RecipeSourcesMatrix, dict]]
+	packs : dict[str, tuple[tuple[str, ...], LayeredSources]]
+	graphs : OrderedDict[str, RecipeGraph]
+	graph_capacity : int
+
+	def __init__( self, index_directory : str | None = None, workers : int = 1, graph_capacity : int = 4 ):
+		self.index_directory = index_directory
+		self.workers = workers
+		self.bases = { }
+		self.packs = { }
+		self.graphs = OrderedDict()
+		self.graph_capacity = graph_capacity
+
+	def index_filepath( self, name : str ) -> str | None:
+		'''Layers get their own index file, an index only keeps the jars of its last run.'''
+		if self.index_directory == None:
+			return None
+		return os.path.join( self.index_directory, f'{name}.bin' )
+
+	def base( self, filepaths : list[str] ) -> tuple[RecipeSourcesMatrix, dict]:
+		'''The shared layer of the base jars (most important first) and its tag nesting, parsed on first use.'''
+		key = tuple( os.path.abspath( filepath ) for filepath in filepaths )
+		layer = self.bases.get( key )
+		if layer == None:
+			digest = hashlib.sha1( '\n'.join( key ).encode('utf-8') ).hexdigest()[:16]
+			sources = extract_sources_from_files( filepaths, workers=self.workers, index_filepath=self.index_filepath( f'base-{digest}' ) )
+			layer = self.bases[key] = ( sources, nesting_parents( sources.tags ) )
+		return layer
+
+	def add_pack( self, name : str, filepaths : list[str], base_filepaths : list[str] ) -> LayeredSources:
+		'''Parse the jars of the pack (most important first, without the base jars) over the base layer.'''
+		base, parents = self.base( base_filepaths )
+		overlay = extract_sources_from_files( filepaths, workers=self.workers, index_filepath=self.index_filepath( f'pack-{name}' ) )
+		sources = LayeredSources( base, overlay, parents )
+		self.packs[name] = ( tuple( os.path.abspath( filepath ) for filepath in base_filepaths ), sources )
+		self.graphs.pop( name, None )
+		return sources
+
+	def remove_pack( self, name : str ) -> None:
+		'''Drop the pack, and its base layer once no other pack uses it.'''
+		base_key, _ = self.packs.pop( name )
+		self.graphs.pop( name, None )
+		if not any( key == base_key for key, _ in self.packs.values() ):
+			self.bases.pop( base_key, None )
+
+	def get( self, name : str ) -> LayeredSources:
+		return self.packs[name][1]
+
+	def graph( self, name : str ) -> RecipeGraph:
+		graph = self.graphs.get( name )
+		if graph != None:
+			self.graphs.move_to_end( name )
+			return graph
+		graph = self.graphs[name] = RecipeGraph.from_sources( self.get( name ) )
+		while len(self.graphs) > self.graph_capacity:
+			self.graphs.popitem( last=False )
+		return graph
+
+	def memory_report( self ) -> dict:
+		'''Recipe bytes of every base layer counted once and of every override layer.'''
+		return {
+			'bases' : { ', '.join( os.path.basename( filepath ) for filepath in key ) : memory_report( sources ) for key, (sources, _) in self.bases.items() },
+			'packs' : { name : memory_report( sources.overlay ) for name, (_, sources) in self.packs.items() },
+		}
@@ -1,144 +1,406 @@
 
+from __future__ import annotations
+
 import os
+import sys
 import json
+import logging
 import traceback
-import numpy
 
-from typing import Any
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from typing import Any, Callable, Iterable, Iterator
 from handler import ZipParser
+from index import RecipeIndex
+from recipe_types import Recipe, ingredient_of, normalise_recipe, recipe_id_of
+from tags import TagIndex, tag_key_of
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+SOURCE_PATHS = [ 'data/(.+)/recipes', 'data/(.+)/loot_tables', 'data/(.+)/tags' ]
 
-def array_find( array : list, value : Any ) -> int:
-	try: return array.index(value)
-	except: return -1
+def read_json_files( files : list[str] ) -> Iterator[tuple[str, Any]]:
+	for filepath in filter(lambda x : x.endswith('.json'), files):
+		with open( filepath, 'r' ) as file:
+			yield filepath, json.loads( file.read() )
 
 def print_unsupported( index : str, unsupported : dict ) -> None:
 	if unsupported.get(index) != None:
 		return
 	unsupported[index] = True
-	print('Unsupported Value:', index)
-
-CRAFTING_TYPES = [
-	'minecraft:crafting_shapeless',
-	'minecraft:crafting_shaped',
-	'minecraft:smelting',
-	'minecraft:blasting',
-	'minecraft:stonecutting',
-
-	'computercraft:turtle',
-	'computercraft:computer_upgrade',
-	'computercraft:impostor_shapeless'
-]
-
-def handle_recipe( recipes_matrix : dict, data : dict, index : str, unsupported : dict ) -> None:
-	SHAPELESS = [
-		'minecraft:crafting_shapeless', 'computercraft:impostor_shapeless'
-	]
-	SHAPED = [
-		'minecraft:crafting_shaped', 'computercraft:turtle',
-		'computercraft:computer_upgrade', 'computercraft:imposter_shaped'
-	]
-
-	if array_find( SHAPELESS, data.get('type')) != -1:
-		# print(data)
-		resultant_name = data.get('result').get('item')
-		resultant_amount = data.get('result').get('count') or 1
-		data = [ index, data.get('ingredients'), resultant_amount ]
-	elif array_find( SHAPED, data.get('type') ) != -1:
-		# print(data)
-		resultant_name = data.get('result').get('item')
-		resultant_amount = data.get('result').get('count') or 1
-		data = [ index, data.get('pattern'), data.get('key'), resultant_amount ]
-	elif data.get('type') == 'minecraft:smelting':
-		# print(data)
-		resultant_name = data.get('result')
-		data = [ index, data.get('ingredient'), 1 ]
-	elif data.get('type') == 'minecraft:blasting':
-		# print(data)
-		resultant_name = data.get('result')
-		data = [ index, data.get('ingredient'), 1 ]
-	elif data.get('type') == 'minecraft:stonecutting':
-		# print(data)
-		resultant_name = data.get('result')
-		resultant_amount = data.get('count') or 1
-		data = [ index, data.get('ingredient').get('item'), resultant_amount ]
-	else:
-		# print_unsupported( data.get('type'), unsupported )
-		return
+	logger.debug('Unsupported Value: %s', index)
+
+def entry_kind( filepath : str ) -> str | None:
+	''''tag' for a data/<namespace>/tags/<registry>/... entry, 'recipe' for a data/<namespace>/recipes/... entry, None otherwise.'''
+	if tag_key_of( filepath ) != None:
+		return 'tag'
+	if recipe_id_of( filepath ) != None:
+		return 'recipe'
+	return None
 
+def handle_recipe( recipes_matrix : dict, data : dict, recipe_id : str | None = None ) -> bool:
+	'''Normalise the recipe through its registered type handler and file it under its output, False when unsupported.'''
+	normalised = normalise_recipe( data, recipe_id )
+	if normalised == None:
+		return False
+	resultant_name, recipe = normalised
 	if recipes_matrix.get(resultant_name) == None:
-		recipes_matrix[resultant_name] = [ data ]
+		recipes_matrix[resultant_name] = [ recipe ]
 	else:
-		recipes_matrix[resultant_name].append( data )
+		recipes_matrix[resultant_name].append( recipe )
+	return True
 
 class RecipeSourcesMatrix:
-	tags : dict = dict()
-	recipes : dict = dict()
-	unsupported : dict = dict()
+	tags : TagIndex
+	recipes : dict[str, list[Recipe]]
+	unsupported : dict
+	failed : dict
+
+	def __init__( self, tags : TagIndex = None, recipes : dict = None, unsupported : dict = None ):
+		self.tags = tags if tags != None else TagIndex()
+		self.recipes = recipes or dict()
+		self.unsupported = unsupported or dict()
+		self.failed = dict()
+
+	def merge( self, sources : RecipeSourcesMatrix ) -> None:
+		'''Merge another matrix over this one, the other matrix wins on conflicting keys.'''
+		self.recipes.update( sources.recipes )
+		self.unsupported.update( sources.unsupported )
+		self.tags.merge( sources.tags )
 
 class MinecraftJarParser(ZipParser):
 
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 
-	def parse_recipes( self, resultant : RecipeSourcesMatrix, files : list[str] ) -> None:
-		for filepath in filter(lambda x : x.find('recipes') != -1 and x.endswith('.json'), files):
-			with open( filepath, 'r' ) as file:
-				jsdata : dict = json.loads( file.read() )
-			if jsdata.get('type') == None:
-				continue
-			if array_find( CRAFTING_TYPES, jsdata.get('type') ) != -1:
-				handle_recipe( resultant.recipes, jsdata, jsdata.get('type'), resultant.unsupported )
-			# else:
-			# 	print_unsupported( jsdata.get('type'), resultant.unsupported )
-
-	def parse_tags( self, resultant : RecipeSourcesMatrix, files : list[str] ) -> None:
-		for filepath in filter(lambda x : x.find('tags') != -1 and x.endswith('.json'), files):
-			with open( filepath, 'r' ) as file:
-				jsdata : dict = json.loads( file.read() )
-			tag_name : str = os.path.splitext(os.path.basename(filepath))[0]
-			if resultant.tags.get( tag_name ) == None:
-				resultant.tags[ tag_name ] = jsdata.get('values')
-			else:
-				values = resultant.tags[ tag_name ]
-				values.extend( jsdata.get('values') )
-				resultant.tags[ tag_name ] = numpy.unique(values).tolist()
+	def parse_recipe( self, resultant : RecipeSourcesMatrix, jsdata : dict, filepath : str | None = None ) -> None:
+		if jsdata.get('type') == None:
+			return
+		with METRICS.timer('recipe_normalise'):
+			handled = handle_recipe( resultant.recipes, jsdata, recipe_id_of( filepath ) )
+		if handled == True:
+			METRICS.increment('recipes', labels={ 'type' : jsdata.get('type') })
+		else:
+			METRICS.increment('recipes_unsupported', labels={ 'type' : str( jsdata.get('type') ) })
+			print_unsupported( str( jsdata.get('type') ), resultant.unsupported )
+
+	def parse_tag( self, resultant : RecipeSourcesMatrix, filepath : str, jsdata : dict ) -> None:
+		key = tag_key_of( filepath )
+		if key == None:
+			return
+		with METRICS.timer('tag_merge'):
+			resultant.tags.add( key[0], key[1], jsdata.get('values'), jsdata.get('replace') == True )
+
+	def parse_entry( self, filepath : str, jsdata : dict ) -> tuple[str | None, Any]:
+		'''Reduce one json entry to what it contributes to the jar, ('tag', (registry, name, values, replace)) or ('recipe', { item : [data] }).'''
+		kind = entry_kind( filepath )
+		if kind == 'tag':
+			key = tag_key_of( filepath )
+			return 'tag', ( key[0], key[1], jsdata.get('values'), jsdata.get('replace') == True )
+		if kind == 'recipe':
+			contribution = RecipeSourcesMatrix( )
+			self.parse_recipe( contribution, jsdata, filepath )
+			return 'recipe', contribution.recipes
+		return None, None
+
+	def parse_recipes( self, resultant : RecipeSourcesMatrix, entries : Iterable[tuple[str, dict]] ) -> None:
+		for filepath, jsdata in entries:
+			if entry_kind( filepath ) == 'recipe':
+				self.parse_recipe( resultant, jsdata, filepath )
 
-	def extract_recipe_sources( self ) -> RecipeSourcesMatrix | None:
-		success, data = self.extract_files_in_paths([ 'data/(.+)/recipes', 'data/(.+)/loot_tables', 'data/(.+)/tags' ])
+	def parse_tags( self, resultant : RecipeSourcesMatrix, entries : Iterable[tuple[str, dict]] ) -> None:
+		for filepath, jsdata in entries:
+			if entry_kind( filepath ) == 'tag':
+				self.parse_tag( resultant, filepath, jsdata )
+
+	def stream_recipe_sources( self ) -> RecipeSourcesMatrix:
+		'''Parse tags and recipes straight out of the open jar in a single pass, without extracting to disk.'''
+		resultant = RecipeSourcesMatrix( )
+		total = 0
+		for filepath, jsdata in self.stream_json_in_paths( SOURCE_PATHS ):
+			total += 1
+			kind = entry_kind( filepath )
+			if kind == 'tag':
+				self.parse_tag( resultant, filepath, jsdata )
+			elif kind == 'recipe':
+				self.parse_recipe( resultant, jsdata, filepath )
+		logger.info('%d total files.', total)
+		return resultant
+
+	def index_recipe_sources( self, previous : dict | None = None ) -> tuple[dict, tuple[int, int, int]]:
+		'''
+		Build the per-entry records of the jar, { filename : (crc, size, kind, payload) } in zip order.
+		Recipes are stored in their to_json() form so the records stay marshal-able.
+		Entries whose CRC and size match the previous records are reused without being decompressed.
+		Returns the records and the (reused, parsed, removed) entry counts.
+		'''
+		previous = previous or { }
+		signatures = { filename : (record[0], record[1]) for filename, record in previous.items() }
+		entries, changed, removed = self.diff_json_in_paths( SOURCE_PATHS, signatures )
+		changed_names = set( item.filename for item in changed )
+		records = { }
+		try:
+			for item in entries:
+				if item.filename not in changed_names:
+					records[item.filename] = previous[item.filename]
+					continue
+				try:
+					kind, payload = self.parse_entry( item.filename, self.read_json( item ) )
+					if kind == 'recipe':
+						payload = { output : [ recipe.to_json() for recipe in recipes ] for output, recipes in payload.items() }
+				except Exception as exception:
+					logger.error('Failed to decode: %s\n%s', item.filename, exception)
+					kind, payload = None, None
+				records[item.filename] = (item.CRC, item.file_size, kind, payload)
+		finally:
+			self.close_reader( )
+		return records, (len(entries) - len(changed), len(changed), len(removed))
+
+	def extract_recipe_sources( self, stream : bool = True ) -> RecipeSourcesMatrix | None:
+		if stream == True:
+			if not self.file_exists():
+				return None
+			return self.stream_recipe_sources( )
+
+		success, data = self.extract_files_in_paths( SOURCE_PATHS )
 		if success == False: return None
 
-		print(data.directory)
-		print(len(data.files), 'total files.')
+		logger.info('Extracted to %s, %d total files.', data.directory, len(data.files))
 
 		resultant = RecipeSourcesMatrix( )
 
 		# use to map recipe tag-groups to individual references
-		self.parse_tags( resultant, data.files )
+		self.parse_tags( resultant, read_json_files( data.files ) )
 
 		# for each recipe file, parse it if is a whitelisted file
-		self.parse_recipes( resultant, data.files )
+		self.parse_recipes( resultant, read_json_files( data.files ) )
 
 		return resultant
 
-def extract_sources_from_files( filepaths : list ) -> RecipeSourcesMatrix:
+def build_recipe_sources( records : dict ) -> RecipeSourcesMatrix:
+	'''Replay the per-entry records of a jar, in zip order, into the same matrix a full parse produces.'''
+	resultant = RecipeSourcesMatrix( )
+	for _, _, kind, payload in records.values():
+		if kind == 'tag':
+			registry, tag_name, values, replace = payload
+			with METRICS.timer('tag_merge'):
+				resultant.tags.add( registry, tag_name, values, replace )
+		elif kind == 'recipe':
+			for resultant_name, recipes in payload.items():
+				recipes = [ Recipe.from_json( data ) for data in recipes ]
+				if resultant.recipes.get(resultant_name) == None:
+					resultant.recipes[resultant_name] = recipes
+				else:
+					resultant.recipes[resultant_name].extend( recipes )
+	return resultant
+
+def record_outputs( records : dict ) -> dict[str, list[str]]:
+	'''The recipe entries producing each output of a jar, { output : [ filename, ... ] } in zip order.'''
+	outputs = { }
+	for filename, (_, _, kind, payload) in records.items():
+		if kind != 'recipe': continue
+		for resultant_name in payload.keys():
+			if outputs.get( resultant_name ) == None:
+				outputs[resultant_name] = [ filename ]
+			else:
+				outputs[resultant_name].append( filename )
+	return outputs
+
+def pack_recipe_sources( sources : RecipeSourcesMatrix ) -> tuple:
+	'''
+	Columnar, marshal-able form of a jar's matrix, (strings, outputs, recipes, ingredients, uses, tags, replaced):
+		every string is stored once and referenced by its position in strings,
+		outputs holds (output, recipe count) per output and recipes (type, station, amount, ingredient count, id) per recipe,
+		ingredients holds the distinct (name, count) pairs and uses the ingredient of every recipe slot in order.
+	The int columns are array('i') bytes, a recipe without an id stores -1.
+	'''
+	strings = { }
+	pairs = { }
+	outputs, recipes, ingredients, uses = array('i'), array('i'), array('i'), array('i')
+
+	def string_id( value : str ) -> int:
+		index = strings.get( value )
+		if index == None:
+			index = strings[value] = len(strings)
+		return index
+
+	for output, item_recipes in sources.recipes.items():
+		outputs.extend( ( string_id( output ), len(item_recipes) ) )
+		for recipe in item_recipes:
+			recipes.extend( ( string_id( recipe.type ), string_id( recipe.station ), recipe.amount, len(recipe.ingredients), string_id( recipe.id ) if recipe.id != None else -1 ) )
+			for ingredient in recipe.ingredients:
+				key = (ingredient.name, ingredient.count)
+				index = pairs.get( key )
+				if index == None:
+					index = pairs[key] = len(pairs)
+					ingredients.extend( ( string_id( ingredient.name ), ingredient.count ) )
+				uses.append( index )
+	tags = [ (registry, name, tuple( values.keys() )) for (registry, name), values in sources.tags.tags.items() ]
+	return tuple( strings.keys() ), outputs.tobytes(), recipes.tobytes(), ingredients.tobytes(), uses.tobytes(), tags, sorted( sources.tags.replaced )
+
+def unpack_recipe_sources( packed : tuple ) -> RecipeSourcesMatrix:
+	'''The matrix of a pack_recipe_sources() form, every distinct ingredient and string is only built once.'''
+	strings, outputs, recipes, ingredients, uses, tags, replaced = packed
+	strings = [ sys.intern( value ) if type(value) == str else value for value in strings ]
+	columns = [ ]
+	for column in ( outputs, recipes, ingredients, uses ):
+		values = array('i')
+		values.frombytes( column )
+		columns.append( values.tolist() )
+	outputs, recipes, ingredients, uses = columns
+	shared = [ ingredient_of( strings[ ingredients[index] ], ingredients[index + 1] ) for index in range( 0, len(ingredients), 2 ) ]
+	slots = [ shared[index] for index in uses ]
+
+	resultant = RecipeSourcesMatrix( )
+	recipe, slot = 0, 0
+	for index in range( 0, len(outputs), 2 ):
+		item_recipes = [ ]
+		for _ in range( outputs[index + 1] ):
+			type_id, station_id, amount, count, recipe_id = recipes[recipe : recipe + 5]
+			item_recipes.append( Recipe( strings[type_id], strings[station_id], tuple( slots[slot : slot + count] ), amount, strings[recipe_id] if recipe_id != -1 else None ) )
+			recipe += 5
+			slot += count
+		resultant.recipes[ strings[ outputs[index] ] ] = item_recipes
+	for registry, name, values in tags:
+		resultant.tags.tags[(registry, name)] = dict.fromkeys( values )
+	resultant.tags.replaced = set( tuple( key ) for key in replaced )
+	return resultant
+
+def extract_sources_from_file( filepath : str ) -> tuple[str, tuple[dict, dict, dict] | None, str | None]:
+	'''Parse one jar and return a compact picklable (filepath, (recipes, tags, unsupported), error) result.'''
+	try:
+		sources = MinecraftJarParser(filepath).extract_recipe_sources()
+		if sources == None:
+			return filepath, None, 'Could not open file for reading.'
+		return filepath, (sources.recipes, sources.tags, sources.unsupported), None
+	except Exception as exception:
+		return filepath, None, ''.join( traceback.format_exception( exception ) )
+
+def index_sources_from_file( job : tuple[str, dict | None] ) -> tuple[str, tuple[dict, tuple] | None, str | None]:
+	'''Re-index one jar against its previous entry records, returns (filepath, (records, packed matrix), error).'''
+	filepath, previous = job
+	try:
+		records, (reused, parsed, removed) = MinecraftJarParser(filepath).index_recipe_sources( previous )
+		logger.info('Indexed %s: %d parsed, %d reused, %d removed entries.', filepath, parsed, reused, removed)
+		METRICS.increment('index_entries_parsed', parsed)
+		METRICS.increment('index_entries_reused', reused)
+		return filepath, (records, pack_recipe_sources( build_recipe_sources( records ) )), None
+	except Exception as exception:
+		return filepath, None, ''.join( traceback.format_exception( exception ) )
+
+def measured( job : tuple[Callable, Any] ) -> tuple[Any, dict]:
+	'''Run a worker function in a pool process and send back its result with the metrics it recorded.'''
+	function, argument = job
+	before = METRICS.state()
+	return function( argument ), METRICS.delta( before )
+
+def map_in_pool( function : Callable, jobs : list, workers : int ) -> list:
+	'''executor.map over the jobs, merging the metrics of every worker into this process.'''
+	with ProcessPoolExecutor( max_workers=( workers if workers > 0 else None ) ) as executor:
+		results = [ ]
+		for result, delta in executor.map( measured, [ (function, job) for job in jobs ] ):
+			METRICS.merge( delta )
+			results.append( result )
+		return results
+
+def index_sources_from_files( filepaths : list, index : RecipeIndex, workers : int = 1 ) -> dict[str, RecipeSourcesMatrix | str]:
+	'''
+	Bring the index up to date for the given jars and return { filepath : matrix or error } for each of them.
+	Unchanged jars are unpacked from their packed matrix, changed jars only re-parse the entries whose CRC or size moved.
+	'''
+	packed = { }
+	pending = [ ]
+	for filepath in filepaths:
+		current = index.get_packed( filepath )
+		if current != None:
+			packed[filepath] = current
+		else:
+			pending.append( (filepath, index.get_previous( filepath )) )
+
+	if workers == 1 or len(pending) <= 1:
+		parsed = map( index_sources_from_file, pending )
+	else:
+		parsed = map_in_pool( index_sources_from_file, pending, workers )
+
+	resultant = { }
+	for filepath, data, error in parsed:
+		if error != None:
+			resultant[filepath] = error
+			continue
+		records, packed[filepath] = data
+		index.set( filepath, records, packed[filepath], record_outputs( records ) )
+
+	for filepath, data in packed.items():
+		resultant[filepath] = unpack_recipe_sources( data )
+	return resultant
+
+def extract_sources_from_files( filepaths : list, workers : int = 1, index_filepath : str | None = None ) -> RecipeSourcesMatrix:
+	'''
+	Parse every jar and merge them so that jars earlier in the list take priority.
+
+	With workers > 1 the jars are parsed in a process pool (workers <= 0 uses every core),
+	the results are still merged in the same order as a serial run so the output is identical.
+	With an index_filepath, unchanged jars are loaded from the compiled index and changed jars
+	only re-parse the entries whose CRC or size differ from the previous run.
+	'''
+	existing = [ ]
+	for filepath in filepaths:
+		if not os.path.exists(filepath):
+			logger.warning('File does not exist at filepath, skipping: %s', filepath)
+			continue
+		existing.append( filepath )
+
+	if index_filepath != None:
+		index = RecipeIndex( index_filepath )
+		success, err = index.load()
+		if success == False:
+			logger.info('Rebuilding recipe index: %s', err)
+		index.retain( existing )
+		results = index_sources_from_files( existing, index, workers=workers )
+		if index.dirty == True:
+			success, err = index.save()
+			if success == False:
+				logger.error('Failed to save recipe index: %s', err)
+	else:
+		if workers == 1 or len(existing) <= 1:
+			parsed = map( extract_sources_from_file, existing )
+		else:
+			parsed = map_in_pool( extract_sources_from_file, existing, workers )
+		results = { }
+		for filepath, data, error in parsed:
+			results[filepath] = error if error != None else RecipeSourcesMatrix( data[1], data[0], data[2] )
+
+	return merge_recipe_sources( existing, results )
+
+def merge_recipe_sources( filepaths : list, results : dict[str, RecipeSourcesMatrix | str] ) -> RecipeSourcesMatrix:
+	'''Merge per-jar matrices, most important first, into a new matrix, the per-jar matrices are left untouched.'''
 	recipe_sources = RecipeSourcesMatrix()
 	for filepath in reversed(filepaths):
-		if not os.path.exists(filepath):
-			print('File does not exist at filepath, skipping:', filepath)
+		sources = results[filepath]
+		if type(sources) == str:
+			logger.error('Failed to parse: %s\n%s', filepath, sources)
+			recipe_sources.failed[filepath] = sources
 			continue
-		try:
-			sources = MinecraftJarParser(filepath).extract_recipe_sources()
+		with METRICS.timer('recipe_merge'):
 			recipe_sources.recipes.update( sources.recipes )
 			recipe_sources.unsupported.update( sources.unsupported )
-			recipe_sources.tags.update( sources.tags )
-		except Exception as exception:
-			print('--------------------')
-			traceback.print_exception( exception )
-			print('--------------------')
+		with METRICS.timer('tag_merge'):
+			recipe_sources.tags.merge( sources.tags )
+	with METRICS.timer('tag_merge'):
+		recipe_sources.tags.compile()
 	return recipe_sources
 
 if __name__ == '__main__':
 
+	from export import write_recipes_json, write_tags_json, write_recipes_ndjson, write_tags_ndjson
+	from metrics import LoggingSink, PrometheusSink
+
+	logging.basicConfig( level=logging.INFO )
+	METRICS.add_sink( LoggingSink() )
+	METRICS.add_sink( PrometheusSink('mc-src-info/metrics.prom') )
+
 	# put important ones first
 	resultant = extract_sources_from_files([
 		'temp/forge-40.2.0.jar',
@@ -147,14 +409,19 @@ if __name__ == '__main__':
 		# 'temp/AdvancedPeripherals-1.18.2-0.7.31r.jar',
 		# 'temp/MorePeripherals_1.18.2-1.8.jar',
 		# 'temp/toms-peripherals-1.18.2-1.1.0.jar',
-	])
+	], index_filepath='mc-src-info/index.bin')
 
 	print('Dumping to file.')
 	os.makedirs('mc-src-info', exist_ok=True)
 	with open('mc-src-info/recipes.json', 'w') as file:
-		file.write(json.dumps(resultant.recipes, indent=4))
+		write_recipes_json( resultant.recipes, file )
 	with open('mc-src-info/tags.json', 'w') as file:
-		file.write(json.dumps(resultant.tags, indent=4))
+		write_tags_json( resultant.tags, file )
+	with open('mc-src-info/recipes.ndjson', 'w') as file:
+		write_recipes_ndjson( resultant.recipes, file )
+	with open('mc-src-info/tags.ndjson', 'w') as file:
+		write_tags_ndjson( resultant.tags, file )
 	# with open('mc-src-info/unsupported.json', 'w') as file:
 	# 	file.write(json.dumps(resultant.unsupported, indent=4))
 	print('Completed dumping.')
+	METRICS.flush()
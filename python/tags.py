@@ -0,0 +1,106 @@
+
+from __future__ import annotations
+
+import re
+
+from typing import Any
+
+TAG_PATH = re.compile( r'data/([^/]+)/tags/([^/]+)/(.+)\.json$' )
+
+def tag_key_of( filepath : str ) -> tuple[str, str] | None:
+	'''(registry, namespace:path) of a tag file, e.g. data/forge/tags/items/ores/iron.json -> ('items', 'forge:ores/iron').'''
+	match = TAG_PATH.search( filepath.replace('\\', '/') )
+	if match == None:
+		return None
+	namespace, registry, path = match.groups()
+	return registry, f'{namespace}:{path}'
+
+def tag_value_id( value : Any ) -> str | None:
+	'''Tag values are either a plain id or { "id" : ..., "required" : ... }.'''
+	if type(value) == dict:
+		value = value.get('id')
+	return value if type(value) == str else None
+
+class TagIndex:
+	'''
+	Tags keyed by (registry, namespace:path) with ordered set semantics.
+
+	Values keep their raw form, nested tags stay "#" prefixed. expand() returns the
+	transitive set of concrete ids of a tag, these are precomputed by compile() and
+	recomputed lazily after the index changes.
+	'''
+
+	tags : dict[tuple[str, str], dict[str, None]]
+	replaced : set[tuple[str, str]]
+	expanded : dict[tuple[str, str], tuple[str, ...]] | None
+
+	def __init__( self ):
+		self.tags = { }
+		self.replaced = set()
+		self.expanded = None
+
+	def __len__( self ) -> int:
+		return len(self.tags)
+
+	def add( self, registry : str, name : str, values : list | None, replace : bool = False ) -> None:
+		key = (registry, name)
+		ids = dict.fromkeys( value for value in map( tag_value_id, values or [ ] ) if value != None )
+		if replace == True or self.tags.get( key ) == None:
+			self.tags[key] = ids
+		else:
+			self.tags[key].update( ids )
+		if replace == True:
+			self.replaced.add( key )
+		self.expanded = None
+
+	def merge( self, other : TagIndex ) -> None:
+		'''Merge another index over this one, its tags extend ours unless they were declared with replace.'''
+		for key, values in other.tags.items():
+			if key in other.replaced or self.tags.get( key ) == None:
+				self.tags[key] = dict( values )
+			else:
+				self.tags[key].update( values )
+		self.replaced.update( other.replaced )
+		self.expanded = None
+
+	def get( self, name : str, registry : str = 'items' ) -> list[str] | None:
+		values = self.tags.get( (registry, name) )
+		return list(values) if values != None else None
+
+	def compile( self ) -> None:
+		'''Precompute the transitive expansion of every tag, nested tag cycles are cut.'''
+		self.expanded = { }
+		for key in self.tags.keys():
+			self.expand_key( key, set() )
+
+	def expand_key( self, key : tuple[str, str], visiting : set ) -> tuple[str, ...]:
+		cached = self.expanded.get( key )
+		if cached != None:
+			return cached
+		visiting.add( key )
+		result = { }
+		for value in self.tags.get( key, { } ).keys():
+			if not value.startswith('#'):
+				result[value] = None
+				continue
+			nested = (key[0], value[1:])
+			if nested in visiting:
+				continue
+			result.update( dict.fromkeys( self.expand_key( nested, visiting ) ) )
+		visiting.discard( key )
+		self.expanded[key] = tuple( result.keys() )
+		return self.expanded[key]
+
+	def expand( self, name : str, registry : str = 'items' ) -> tuple[str, ...]:
+		'''Every concrete id in the tag, following nested tags.'''
+		if self.expanded == None:
+			self.compile()
+		return self.expanded.get( (registry, name), () )
+
+	def to_json( self ) -> dict[str, dict[str, list[str]]]:
+		data = { }
+		for (registry, name), values in self.tags.items():
+			if data.get( registry ) == None:
+				data[registry] = { }
+			data[registry][name] = list( values )
+		return data
@@ -0,0 +1,15 @@
+
+from __future__ import annotations
+
+from typing import Any
+
+def array_find( array : list, value : Any ) -> int:
+	try: return array.index(value)
+	except: return -1
+
+def cache_increment_index( cache : dict, index : Any, amount : int ) -> None:
+	cache[index] = cache.get(index, 0) + amount
+
+def cache_push_increment( cache : dict, values : dict ) -> None:
+	for index, amount in values.items():
+		cache_increment_index( cache, index, amount )
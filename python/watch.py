@@ -0,0 +1,185 @@
+
+from __future__ import annotations
+
+import os
+import time
+import logging
+import argparse
+import threading
+
+from typing import Callable
+
+from sources import RecipeSourcesMatrix, index_sources_from_files, merge_recipe_sources
+from index import RecipeIndex, file_signature
+from graph import RecipeGraph
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+def list_jars( paths : list[str] ) -> list[str]:
+	'''Expand the configured paths, most important first, directories contribute their jars in name order.'''
+	filepaths = [ ]
+	for path in paths:
+		if os.path.isdir( path ):
+			filepaths.extend( sorted( os.path.join( path, name ) for name in os.listdir( path ) if name.endswith('.jar') ) )
+		elif os.path.exists( path ):
+			filepaths.append( path )
+	return filepaths
+
+def changed_outputs( previous : RecipeSourcesMatrix, sources : RecipeSourcesMatrix, touched : list[RecipeSourcesMatrix | str | None] ) -> set[str]:
+	'''Outputs of the touched jars whose merged recipes differ between two merges.'''
+	outputs = set()
+	for jar in touched:
+		if type(jar) != RecipeSourcesMatrix: continue
+		for name in jar.recipes.keys():
+			# merges keep the recipe lists of the jars, an output still won by an untouched jar has the same list
+			before, after = previous.recipes.get( name ), sources.recipes.get( name )
+			if before is not after and before != after:
+				outputs.add( name )
+	return outputs
+
+class SourceWatcher:
+	'''
+	Keeps the merged sources and compiled graph of a modpack hot while its jars change.
+
+	poll() compares the size and mtime of every jar against the last reload and re-indexes only the
+	jars that changed, entry by entry through the RecipeIndex. The merge is rebuilt from the per-jar
+	matrices kept in memory, the graph is patched for the outputs of the reloaded jars whose recipes
+	changed, and both are published as a single (sources, graph) tuple, so readers never see a graph
+	from one reload with the sources of another. The index is saved after publishing. A jar is only
+	picked up once its signature is the same on two consecutive polls, so half-copied jars are not parsed.
+	'''
+
+	paths : list[str]
+	index : RecipeIndex
+	workers : int
+	filepaths : list[str]
+	signatures : dict[str, tuple[int, int]]
+	pending : dict[str, tuple[int, int]]
+	jars : dict[str, RecipeSourcesMatrix | str]
+	state : tuple[RecipeSourcesMatrix, RecipeGraph] | None
+	listeners : list[Callable[[RecipeSourcesMatrix, RecipeGraph], None]]
+	lock : threading.Lock
+
+	def __init__( self, paths : list[str], index_filepath : str | None = None, workers : int = 1 ):
+		self.paths = list( paths )
+		self.index = RecipeIndex( index_filepath )
+		self.workers = workers
+		self.filepaths = [ ]
+		self.signatures = { }
+		self.pending = { }
+		self.jars = { }
+		self.state = None
+		self.listeners = [ ]
+		self.lock = threading.Lock()
+		if index_filepath != None:
+			success, err = self.index.load()
+			if success == False:
+				logger.info('Rebuilding recipe index: %s', err)
+
+	@property
+	def sources( self ) -> RecipeSourcesMatrix | None:
+		return self.state[0] if self.state != None else None
+
+	@property
+	def graph( self ) -> RecipeGraph | None:
+		return self.state[1] if self.state != None else None
+
+	def changed_jars( self, filepaths : list[str] ) -> list[str]:
+		'''Jars whose signature moved since they were loaded and has settled since the previous poll.'''
+		changed = [ ]
+		for filepath in filepaths:
+			try:
+				signature = file_signature( filepath )
+			except OSError:
+				continue
+			if self.signatures.get( filepath ) == signature:
+				self.pending.pop( filepath, None )
+				continue
+			# the first poll loads everything straight away, later changes wait for the jar to settle
+			if self.state == None or self.pending.get( filepath ) == signature:
+				self.pending.pop( filepath, None )
+				changed.append( filepath )
+			else:
+				self.pending[filepath] = signature
+		return changed
+
+	def poll( self ) -> bool:
+		'''Reload the changed, added and removed jars, returns whether a new state was published.'''
+		with self.lock:
+			start = time.perf_counter()
+			filepaths = list_jars( self.paths )
+			changed = self.changed_jars( filepaths )
+			current = set( filepaths )
+			removed = [ filepath for filepath in self.jars.keys() if filepath not in current ]
+			if len(changed) == 0 and len(removed) == 0 and filepaths == self.filepaths and self.state != None:
+				return False
+
+			with METRICS.timer('reload'):
+				# the outputs of every jar that changed, was added or was removed may now come from another jar
+				touched = [ ]
+				for filepath in removed:
+					touched.append( self.jars.pop( filepath, None ) )
+					self.signatures.pop( filepath, None )
+				self.index.retain( filepaths )
+				for filepath, sources in index_sources_from_files( changed, self.index, workers=self.workers ).items():
+					self.signatures[filepath] = file_signature( filepath )
+					if type(sources) == str and type(self.jars.get( filepath )) == RecipeSourcesMatrix:
+						logger.error('Failed to reload %s, keeping its previous recipes:\n%s', filepath, sources)
+						continue
+					touched.extend( ( self.jars.get( filepath ), sources ) )
+					self.jars[filepath] = sources
+				loaded = [ filepath for filepath in filepaths if filepath in self.jars ]
+				sources = merge_recipe_sources( loaded, self.jars )
+				if self.state == None:
+					graph = RecipeGraph.from_sources( sources )
+				else:
+					graph = self.state[1].patch( sources, changed_outputs( self.state[0], sources, touched ) )
+				self.filepaths = filepaths
+				self.state = (sources, graph)
+			METRICS.increment('reloads')
+			logger.info('Reloaded %d changed and %d removed jars in %.3fs.', len(changed), len(removed), time.perf_counter() - start)
+			state = self.state
+		for listener in self.listeners:
+			listener( state[0], state[1] )
+
+		# the new state is already published, the index is only read on the next start
+		with self.lock:
+			if self.index.filepath != None and self.index.dirty == True:
+				success, err = self.index.save()
+				if success == False:
+					logger.error('Failed to save recipe index: %s', err)
+		return True
+
+	def watch( self, interval : float = 0.25, stop : threading.Event | None = None ) -> None:
+		stop = stop or threading.Event()
+		while not stop.is_set():
+			try:
+				self.poll()
+			except Exception:
+				logger.exception('Reload failed.')
+			stop.wait( interval )
+
+	def start( self, interval : float = 0.25 ) -> tuple[threading.Thread, threading.Event]:
+		'''Watch on a daemon thread, set the returned event to stop it.'''
+		stop = threading.Event()
+		thread = threading.Thread( target=self.watch, args=( interval, stop ), daemon=True )
+		thread.start()
+		return thread, stop
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser( description='Keep the recipe index of a modpack hot and reload changed jars.' )
+	parser.add_argument( 'paths', nargs='+', help='jar files or mod directories, most important first' )
+	parser.add_argument( '--index', default='mc-src-info/index.bin' )
+	parser.add_argument( '--workers', type=int, default=1 )
+	parser.add_argument( '--interval', type=float, default=0.25 )
+	arguments = parser.parse_args()
+
+	logging.basicConfig( level=logging.INFO )
+	watcher = SourceWatcher( arguments.paths, index_filepath=arguments.index, workers=arguments.workers )
+	watcher.listeners.append( lambda sources, graph : print(f'{graph.recipe_total - graph.dead_recipes} recipes, {graph.item_count} items.') )
+	try:
+		watcher.watch( arguments.interval )
+	except KeyboardInterrupt:
+		pass
@@ -2,12 +2,17 @@
 from __future__ import annotations
 
 import json
+import logging
 
+from collections import OrderedDict
 from enum import Enum
 from math import ceil
 from typing import Any
 
 from utility import array_find, cache_increment_index, cache_push_increment
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
 
 class RecipeType(Enum):
 	UNKNOWN = 0
@@ -26,17 +31,204 @@ def construct_craft_recipe( amount : int, *args : str ) -> list[str]:
 	for index, value in enumerate(args): recipe[index] = value
 	return { 'recipe' : recipe, 'amount' : amount}
 
-def natural_resource( sources : list, blocks : list ) -> dict:
-	return { 'sources' : sources, 'blocks' : blocks, 'craft' : None, 'smelt' : None }
+class ItemSource:
+	'''How a block is obtained, replaces the { 'sources', 'blocks', 'craft', 'smelt' } dicts without a per-object dict.'''
+
+	__slots__ = ( 'sources', 'blocks', 'craft', 'smelt' )
+
+	sources : list[RecipeType]
+	blocks : list[str] | None
+	craft : list[dict] | None
+	smelt : list[str] | None
+
+	def __init__( self, sources : list[RecipeType], blocks : list[str] | None = None, craft : list[dict] | None = None, smelt : list[str] | None = None ):
+		self.sources = sources
+		self.blocks = blocks
+		self.craft = craft
+		self.smelt = smelt
+
+	@classmethod
+	def from_json( cls, data : dict ) -> ItemSource:
+		return cls( [ RecipeType(value) for value in data.get('sources') ], data.get('blocks'), data.get('craft'), data.get('smelt') )
+
+	def to_json( self ) -> dict:
+		return { 'sources' : [ source.value for source in self.sources ], 'blocks' : self.blocks, 'craft' : self.craft, 'smelt' : self.smelt }
+
+def natural_resource( sources : list, blocks : list ) -> ItemSource:
+	return ItemSource( sources, blocks=blocks )
+
+def craftable_resource( recipes : list[list] ) -> ItemSource:
+	return ItemSource( [ RecipeType.CRAFT ], craft=recipes )
+
+def smeltable_resource( blocks : list[str] ) -> ItemSource:
+	return ItemSource( [ RecipeType.SMELT ], smelt=blocks )
+
+class SmartRecipeSystem:
+
+	RECIPE_CACHE : dict[str, ItemSource]
+	USED_BY : dict[str, set[str]]
+	EXPANSION_CACHE : OrderedDict[tuple[str, int], tuple[dict, int]]
+	EXPANSION_KEYS : dict[str, set[tuple[str, int]]]
+
+	cache_size : int | None
+	hits : int
+	misses : int
+
+	def __init__(self, cache_size : int | None = 4096):
+		'''cache_size is the maximum number of memoised (block, crafts) expansions, None is unbounded and 0 disables it.'''
+		self.RECIPE_CACHE = { }
+		self.USED_BY = { }
+		self.EXPANSION_CACHE = OrderedDict()
+		self.EXPANSION_KEYS = { }
+		self.cache_size = cache_size
+		self.hits = 0
+		self.misses = 0
+
+	def add( self, block : str, source : ItemSource ) -> None:
+		self.unlink( block )
+		self.RECIPE_CACHE[block] = source
+		self.link( block )
+		self.invalidate( block )
+
+	def remove( self, block : str ) -> ItemSource | None:
+		self.unlink( block )
+		self.invalidate( block )
+		return self.RECIPE_CACHE.pop(block, None)
+
+	def get( self, block : str ) -> ItemSource | None:
+		return self.RECIPE_CACHE.get(block)
+
+	def update( self, json : dict ) -> None:
+		for key, value in json.items():
+			self.add( key, value )
 
-def craftable_resource( recipes : list[list] ) -> dict:
-	return { 'sources' : [ RecipeType.CRAFT ], 'blocks' : None, 'craft' : recipes, 'smelt' : None }
+	def from_json( self, json : dict ) -> None:
+		self.RECIPE_CACHE = { block : source if type(source) == ItemSource else ItemSource.from_json( source ) for block, source in json.items() }
+		self.USED_BY = { }
+		self.EXPANSION_CACHE.clear()
+		self.EXPANSION_KEYS = { }
+		for block in self.RECIPE_CACHE.keys():
+			self.link( block )
 
-def smeltable_resource( blocks : list[str] ) -> dict:
-	return { 'sources' : [ RecipeType.SMELT ], 'blocks' : None, 'craft' : None, 'smelt' : blocks }
+	def to_json( self ) -> str:
+		data = { block : source.to_json() for block, source in self.RECIPE_CACHE.items() }
+		return json.dumps(data, separators=(',', ':')) # separators removes unnecessary spaces
+
+	def dependencies( self, block : str ) -> set[str]:
+		'''Blocks referenced by any recipe of the block.'''
+		source = self.RECIPE_CACHE.get(block)
+		if source == None:
+			return set()
+		blocks = set()
+		for recipe in source.craft or [ ]:
+			blocks.update( count_values( recipe.get('recipe') ).keys() )
+		for smelted in source.smelt or [ ]:
+			blocks.add( smelted )
+		return blocks
+
+	def link( self, block : str ) -> None:
+		for dependency in self.dependencies( block ):
+			if self.USED_BY.get(dependency) == None:
+				self.USED_BY[dependency] = { block }
+			else:
+				self.USED_BY[dependency].add( block )
+
+	def unlink( self, block : str ) -> None:
+		for dependency in self.dependencies( block ):
+			self.USED_BY.get(dependency, set()).discard( block )
+
+	def invalidate( self, block : str ) -> None:
+		'''Drop the cached expansions of the block and every block that (transitively) uses it.'''
+		frontier = [ block ]
+		visited = set()
+		while len(frontier) > 0:
+			item = frontier.pop()
+			if item in visited: continue
+			visited.add( item )
+			for key in self.EXPANSION_KEYS.pop( item, () ):
+				self.EXPANSION_CACHE.pop( key, None )
+			frontier.extend( self.USED_BY.get( item, () ) )
+
+	def cache_info( self ) -> dict:
+		return { 'hits' : self.hits, 'misses' : self.misses, 'size' : len(self.EXPANSION_CACHE), 'capacity' : self.cache_size }
+
+	def cache_store( self, key : tuple[str, int], value : tuple[dict, int] ) -> None:
+		if self.cache_size == 0:
+			return
+		self.EXPANSION_CACHE[key] = value
+		if self.EXPANSION_KEYS.get(key[0]) == None:
+			self.EXPANSION_KEYS[key[0]] = { key }
+		else:
+			self.EXPANSION_KEYS[key[0]].add( key )
+		while self.cache_size != None and len(self.EXPANSION_CACHE) > self.cache_size:
+			evicted, _ = self.EXPANSION_CACHE.popitem( last=False )
+			self.EXPANSION_KEYS.get( evicted[0], set() ).discard( evicted )
+
+	def expand( self, block : str, amount : int, path : frozenset = frozenset() ) -> tuple[dict, int]:
+		'''
+		Raw resources and smelts needed for amount of block, memoised per (block, crafts).
+		Every amount that rounds up to the same number of crafts shares one entry, raw blocks are not cached.
+		'''
+		if block in path:
+			raise ValueError('Recursive recipe detected! ' + str(block))
+
+		recipe = self.get(block)
+		if recipe == None:
+			logger.warning('Failed to find recipe for item %s', block)
+			METRICS.increment('recipes_missing')
+			return { }, 0
+
+		source = recipe.sources
+		if array_find( source, RecipeType.SURFACE ) != -1 or array_find( source, RecipeType.UNDERGROUND ) != -1:
+			return { recipe.blocks[0] : amount }, 0
+		elif array_find( source, RecipeType.ORE_DROP ) != -1 or array_find( source, RecipeType.ORE ) != -1:
+			return { recipe.blocks[0] : amount }, 0
+		elif array_find( source, RecipeType.CRAFT ) != -1:
+			crafts = ceil( amount / recipe.craft[0].get('amount') )
+		elif array_find( source, RecipeType.SMELT ) != -1:
+			crafts = amount
+		else:
+			raise ValueError(f'Unsupported Recipe Source: { [ resolve_source_id(idd) for idd in source ] }')
+
+		key = (block, crafts)
+		cached = self.EXPANSION_CACHE.get(key)
+		if cached != None:
+			self.hits += 1
+			self.EXPANSION_CACHE.move_to_end(key)
+			return cached
+		self.misses += 1
+
+		total_resources = { }
+		total_smelts = 0
+		path = path | { block }
+		if array_find( source, RecipeType.CRAFT ) != -1:
+			for block_id, amount_in_recipe in count_values(recipe.craft[0].get('recipe')).items():
+				resources, smelts = self.expand( block_id, crafts * amount_in_recipe, path )
+				cache_push_increment( total_resources, resources )
+				total_smelts += smelts
+		else:
+			resources, smelts = self.expand( recipe.smelt[0], crafts, path )
+			cache_push_increment( total_resources, resources )
+			total_smelts += smelts + crafts
+
+		self.cache_store( key, (total_resources, total_smelts) )
+		return total_resources, total_smelts
+
+def count_values( array : list ) -> dict:
+	values = { }
+	for value in array:
+		if value != None and value != 'minecraft:air':
+			cache_increment_index( values, value, 1 )
+	return values
+
+def resolve_source_id( target : int ) -> str:
+	for (name, value) in RecipeType.__dict__.items():
+		if name.find('__') == -1 and value == target:
+			return name
+	return "unknown"
 
 minecraft_recipes = SmartRecipeSystem()
-minecraft_recipes.set_json({
+minecraft_recipes.update({
 	"minecraft:cobblestone" : natural_resource(
 		[ RecipeType.UNDERGROUND ],
 		["minecraft:cobblestone"]
@@ -376,132 +568,24 @@ minecraft_recipes.set_json({
 	]),
 })
 
-
-class SmartRecipeSystem:
-
-	RECIPE_CACHE : dict[str, dict]
-
-	def __init__(self):
-		self.RECIPE_CACHE = { }
-
-	def add( self, block : str, source : dict ) -> None:
-		self.RECIPE_CACHE[block] = source
-
-	def remove( self, block : str ) -> dict | None:
-		return self.RECIPE_CACHE.pop(block, None)
-
-	def get( self, block : str ) -> dict | None:
-		return self.RECIPE_CACHE.get(block)
-
-	def update( self, json : dict ) -> None:
-		for key, value in json.items():
-			self.RECIPE_CACHE[key] = value
-
-	def from_json( self, json : dict ) -> None:
-		self.RECIPE_CACHE = json
-
-	def to_json( self ) -> str:
-		return json.dumps(self.RECIPE_CACHE, separators=(',', ':')) # separators removes unnecessary spaces
-
-def count_values( array : list ) -> dict:
-	values = { }
-	for value in array:
-		if value != None and value != 'minecraft:air':
-			cache_increment_index( values, value, 1 )
-	return values
-
-def resolve_source_id( target : int ) -> str:
-	for (name, value) in RecipeType.__dict__.items():
-		if name.find('__') == -1 and value == target:
-			return name
-	return "unknown"
-
 def resolve_recipe_tree( recipe_tree : SmartRecipeSystem, target_id : str, total_amount : int ) -> tuple[dict, int]:
 	root_item = recipe_tree.get(target_id)
 	# print(f'ROOT: {target_id}')
 
 	assert root_item != None, 'Could not find the recipe because it does not exist!'
-	assert array_find( root_item.get('sources'), RecipeType.CRAFT ) != -1, 'The recipe is not a craftable item!'
-
-	first_recipe = root_item.get('craft')[0].get('recipe')
+	assert array_find( root_item.sources, RecipeType.CRAFT ) != -1, 'The recipe is not a craftable item!'
 
-	# resolve the first frontier
-	frontier = [
-		(block_id, req_amount * total_amount)
-		for block_id, req_amount in count_values( first_recipe ).items()
-	]
-
-	total_resources = { }
-	total_smelts = 0
-
-	while len(frontier) > 0:
-		# print(frontier)
-		# frontier = compress_frontier_array(frontier)
-		# print(frontier)
-
-		item = frontier.pop(0)
-
-		item, total_items = item
-		if item == None or item == 'minecraft:air':
-			continue
-
-		if item == target_id:
-			raise ValueError('Recursive recipe detected! ' + str(target_id))
-
-		recipe = recipe_tree.get(item)
-		# print(target_id, recipe)
-		if recipe == None:
-			print(f'Failed to find recipe for item {item}')
-			continue
-
-		# print(item)
-		# print(recipe)
-
-		source = recipe.get('sources')
-
-		if array_find( source, RecipeType.SURFACE ) != -1 or array_find( source, RecipeType.UNDERGROUND ) != -1:
-
-			# print('RESOURCE: ', recipe.get('blocks')[0], total_items )
-			cache_increment_index( total_resources, recipe.get('blocks')[0], total_items )
-
-		elif array_find( source, RecipeType.ORE_DROP ) != -1 or array_find( source, RecipeType.ORE ) != -1:
-
-			cache_increment_index( total_resources, recipe.get('blocks')[0], total_items )
-
-		elif array_find( source, RecipeType.CRAFT ) != -1:
-
-			# print( 'CRAFT: ', item, total_items )
-			first_recipe = recipe.get('craft')[0]
-			for block_id, amount_in_recipe in count_values(first_recipe.get('recipe')).items():
-				second_recipe = recipe_tree.get( block_id )
-				if second_recipe == None:
-					print('Failed to find sub-recipe of block id:', block_id)
-					continue
-
-				if array_find( second_recipe.get('sources'), RecipeType.CRAFT ) == -1:
-					frontier.append( (block_id, amount_in_recipe ) )
-					continue
-				second_out_per_craft = second_recipe.get('craft')[0].get('amount')
-				p = ceil((total_items * amount_in_recipe) / second_out_per_craft)
-				frontier.append( (block_id, p) )
-
-		elif array_find( source, RecipeType.SMELT ) != -1:
-			# print('SMELT: ', item, total_items)
-			smelted_block = recipe.get('smelt')[0]
-			total_smelts += total_items
-			frontier.append( (smelted_block, total_items) )
-		else:
-			raise ValueError(f'Unsupported Recipe Source: { [ resolve_source_id(idd) for idd in source ] }')
-
-	# print('TOTAL_SMELTS: ', total_smelts)
-	return total_resources, total_smelts
+	# subtrees are memoised by the recipe system, copy so callers can't mutate the cache
+	total_resources, total_smelts = recipe_tree.expand( target_id, total_amount )
+	return dict(total_resources), total_smelts
 
 def resolve_multi_tree( recipe_tree : SmartRecipeSystem, items : list[tuple[str, int]], include_fuel : bool = True ) -> tuple[dict, int]:
-	print('-- Resolve Multi-Recipe Material Requirements --')
+	logger.debug('Resolving multi-recipe material requirements of %d items', len(items))
+	METRICS.increment('resolves')
 	total_resources = { }
 	total_smelts = 0
 	for (item_id, amount) in items:
-		print(item_id, amount)
+		logger.debug('%s %d', item_id, amount)
 		resources, smelts = resolve_recipe_tree( recipe_tree, item_id, amount )
 		# print(item_id, resources)
 		# print(resources, smelts)
@@ -513,9 +597,8 @@ def resolve_multi_tree( recipe_tree : SmartRecipeSystem, items : list[tuple[str,
 
 if __name__ == '__main__':
 
-	craft_tree = SmartRecipeSystem.from_minecraft_recipes( directory )
-
-	total_resources, total_smelts = resolve_multi_tree(craft_tree, [
+	logging.basicConfig( level=logging.INFO )
+	total_resources, total_smelts = resolve_multi_tree(minecraft_recipes, [
 		('computercraft:turtle_normal', 1),
 		('minecraft:iron_pickaxe', 1),
 		('minecraft:iron_shovel', 1),